@@ -0,0 +1,83 @@
+#!/bin/python
+
+'''Benchmark of the istiod log analysis on synthetic logs
+
+    python3 benchmark/analyze.py --lines 100000 1000000
+'''
+
+from argparse import ArgumentParser
+from collections import Counter, deque
+from typing import List
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from analyze import IstioDAnalyze, STOP_WORDS
+
+
+MESSAGES = [
+    "ads\tPush debounce stable[{n}] {n} for config ServiceEntry/{ns}/{pod}: 100.0ms since last change",
+    "ads\tXDS: Pushing:2024-01-01T00:00:00Z/{n} Services:{n} ConnectedEndpoints:{n} Version:1.{n}",
+    "ads\tCDS: PUSH request for node:{pod}.{ns} resources:{n} size:{n}kB",
+    "ads\tADS: \"{ip}:{n}\" {pod}.{ns}-{n} terminated rpc error: code = Canceled",
+    "model\tSidecar scope for {pod}.{ns} refers to unknown host {pod}.svc.cluster.local",
+    "validation\tconfig rejected: invalid destination rule {pod} in namespace {ns}"
+]
+
+
+def generate(n: int, warnRatio: float=0.2, seed: int=42) -> List[str]:
+    '''
+    Generates n istiod log lines. warnRatio of them are warnings or errors
+    '''
+    rand = random.Random(seed)
+    lines = []
+    for i in range(n):
+        level = rand.choices(["info", "warn", "error"], [1-warnRatio, warnRatio*0.8, warnRatio*0.2])[0]
+        message = rand.choice(MESSAGES).format(
+            n=rand.randint(0, 9999),
+            ns=f"ns-{rand.randint(0, 40)}",
+            pod=f"app-{rand.randint(0, 500)}-{rand.getrandbits(32):08x}",
+            ip=f"10.{rand.randint(0, 255)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}")
+        lines.append(f"2024-01-01T00:00:{i % 60:02d}.{i:06d}Z\t{level}\t{message}")
+    return lines
+
+
+def reference(logs: List[str], window: int=10) -> List[dict]:
+    '''
+    The analysis before the rolling word count. Rebuilds the word count of the window for each warning
+    '''
+    def mostFrequentWords(logs: List[str], nFrequent: int=5) -> dict:
+        words = " ".join(log.split("\t")[-1] for log in logs).split()
+        words = [w for w in words if w not in STOP_WORDS]
+        return dict(Counter(words).most_common(nFrequent))
+    result = []
+    previous = deque(maxlen=window)
+    for log in logs:
+        splash = log.split("\t")
+        if len(splash) > 3 and splash[1].lower() in ["warn", "error"]:
+            result.append({"trace": splash[-1], "mfw": mostFrequentWords(list(previous)), "time": splash[0], "type": splash[1].lower()})
+        previous.append(log)
+    return result
+
+
+def measure(name: str, func, logs: List[str]) -> float:
+    start = time.perf_counter()
+    result = func(logs)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<12}|{len(logs):>10} lines |{elapsed:8.3f} s |{len(logs)/elapsed:>12,.0f} lines/s |{len(result):>8} warnings")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark of the istiod log analysis")
+    parser.add_argument("--lines", type=int, nargs="+", default=[100000, 1000000], help="number of log lines")
+    parser.add_argument("--warn", type=float, default=0.2, help="ratio of warnings and errors")
+    parser.add_argument("--window", type=int, default=10, help="window size of the most frequent words")
+    args = parser.parse_args()
+    for n in args.lines:
+        logs = generate(n, args.warn)
+        before = measure("reference", lambda l: reference(l, args.window), logs)
+        after = measure("analyze", lambda l: IstioDAnalyze(l, window=args.window).analyze(), logs)
+        print(f"speedup {before/after:.2f}x\n")
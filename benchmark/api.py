@@ -0,0 +1,84 @@
+#!/bin/python
+
+'''Load benchmark of the API on /status
+
+    python3 benchmark/api.py --clients 8 --duration 5
+
+Serves a snapshot of a synthetic run with the production WSGI server and with the Flask development server.
+The clients run in separate processes and send requests on keep-alive connections.
+'''
+
+from argparse import ArgumentParser
+from http.client import HTTPConnection
+from multiprocessing import get_context
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import main
+from faillog import QSLog, Severity
+from werkzeug.serving import make_server
+
+
+def synthetic(clusters: int) -> QSLog:
+    '''
+    A QS log with the results of a run on `clusters` clusters
+    '''
+    log = QSLog()
+    for i in range(clusters):
+        for check in ["nodes", "daemonsets", "prometheusDeployments", "istiodPods", "istiodLogs", "grafana", "prometheus", "alertmanager"]:
+            severity = Severity.FAILED if (i + len(check)) % 17 == 0 else Severity.OK
+            log.event(severity, f"cluster{i}", check, f"Cluster cluster{i}: {check} checked")
+    return log
+
+
+def client(port: int, path: str, duration: float, etag: bool) -> int:
+    connection = HTTPConnection("127.0.0.1", port)
+    headers = {}
+    count = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if etag:
+            headers["If-None-Match"] = response.headers["ETag"]
+        count += 1
+    connection.close()
+    return count
+
+
+def measure(name: str, port: int, args) -> None:
+    with get_context("spawn").Pool(args.clients) as pool:
+        start = time.perf_counter()
+        counts = pool.starmap(client, [(port, args.path, args.duration, args.etag)] * args.clients)
+        elapsed = time.perf_counter() - start
+    print(f"{name:<10}|{args.clients:>4} clients |{sum(counts):>9} requests |{sum(counts)/elapsed:>10,.0f} req/s")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Load benchmark of the API")
+    parser.add_argument("--clients", type=int, default=8, help="number of client processes")
+    parser.add_argument("--duration", type=float, default=5, help="seconds each client sends requests")
+    parser.add_argument("--threads", type=int, default=4, help="threads of the production server")
+    parser.add_argument("--clusters", type=int, default=50, help="clusters of the synthetic run")
+    parser.add_argument("--path", type=str, default="/status", help="requested path")
+    parser.add_argument("--etag", action="store_true", help="send If-None-Match")
+    args = parser.parse_args()
+
+    main.updateLog = synthetic(args.clusters)
+    main.publish()
+
+    threading.Thread(target=main.apiServer, args=(args.threads, 30), daemon=True).start()
+    time.sleep(0.5)
+    measure("waitress", 8080, args)
+    main.stopApiServer()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    development = make_server("127.0.0.1", 8081, main.app, threaded=True)
+    threading.Thread(target=development.serve_forever, daemon=True).start()
+    measure("flask", 8081, args)
+    development.shutdown()
@@ -0,0 +1,214 @@
+#!/bin/python
+
+'''Fleet-scale benchmark of the QS cycle against a local stand-in of Rancher, Prometheus and Grafana
+
+    python3 benchmark/fleet.py --clusters 50 --nodes 20 --latency 0.05 --errors 0.01 --cycles 3
+
+The stand-in server runs in a separate process and answers the Rancher v3 API, the k8s API proxy, the Prometheus query
+API and the Grafana search of N clusters with M nodes each. Every response is delayed by the injected latency and
+fails with a 503 at the injected error rate. The harness runs `QS.run` and reports per cycle the duration, the requests
+the server answered, the response bytes and the peak RSS of the QS process.
+'''
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from urllib.parse import parse_qs, urlparse
+import json
+import os
+import random
+import re
+import resource
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+
+DAEMONSETS = ["rancher-monitoring-prometheus-node-exporter", "canal", "istio-cni-node"]
+
+
+def pod(name: str) -> dict:
+    return {
+        "metadata": {"name": name, "uid": name, "labels": {"istio.io/rev": "default"}},
+        "spec": {"containers": [{"name": "discovery", "image": "istio/pilot:1.20",
+                                 "resources": {"limits": {"cpu": "2", "memory": "1Gi"}}}], "volumes": []},
+        "status": {"containerStatuses": [{"name": "discovery", "restartCount": 0}]}
+    }
+
+
+def handler(clusters: int, nodes: int, latency: float, errors: float, logLines: int):
+    '''
+    Request handler of the stand-in server. Counts the requests and the response bytes
+    '''
+    stats = {"requests": 0, "bytes": 0, "errors": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        wbufsize = 65536
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def send(self, code: int, body, contentType: str="application/json") -> None:
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", contentType)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            with lock:
+                stats["requests"] += 1
+                stats["bytes"] += len(body)
+
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            path = re.sub("/+", "/", url.path)
+            query = parse_qs(url.query)
+            if path == "/stats":
+                with lock:
+                    body = json.dumps(stats).encode()
+                    if "reset" in query:
+                        stats.update(requests=0, bytes=0, errors=0)
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if latency:
+                time.sleep(latency)
+            if errors and random.random() < errors:
+                with lock:
+                    stats["errors"] += 1
+                return self.send(503, {"error": "injected"})
+            self.route(path, query)
+
+        def route(self, path: str, query: dict) -> None:
+            if path == "/v3/clusters":
+                return self.send(200, {"data": [{"name": f"cluster{i}", "id": f"c-{i}", "state": "active"} for i in range(clusters)]})
+            if re.match(r"/v3/clusters/c-\d+/nodes", path):
+                return self.send(200, {"data": [{"nodeName": f"node{i}", "conditions": [{"type": "Ready", "status": "True"}]} for i in range(nodes)]})
+            match = re.match(r"/v3/clusters/(c-\d+)/projects", path)
+            if match:
+                return self.send(200, {"data": [{"id": f"{match.group(1)}:p-system", "name": "System"}]})
+            if re.match(r"/v3/projects/.*/daemonsets", path):
+                daemonsets = [{"name": name, "daemonSetStatus": {"currentNumberScheduled": nodes, "desiredNumberScheduled": nodes, "numberAvailable": nodes}}
+                              for name in DAEMONSETS if query.get("name", [name])[0] == name]
+                return self.send(200, {"data": daemonsets})
+            if re.match(r"/v3/projects/.*/workloads", path):
+                return self.send(200, {"data": [{"name": "prometheus", "state": "active"}]})
+            if re.match(r"/k8s/clusters/c-\d+/api/v1/namespaces/[^/]+/pods/[^/]+/log", path):
+                lines = []
+                for i in range(logLines):
+                    level = "warn" if i % 7 == 0 else "info"
+                    line = f"2026-01-01T10:{i // 60 % 60:02d}:{i % 60:02d}.000000Z\t{level}\tads\tpush debounce for pod-{random.randint(0, 999)} 10.0.0.{i % 256} new request"
+                    lines.append(f"2026-01-01T10:{i // 60 % 60:02d}:{i % 60:02d}.000000000Z {line}" if query.get("timestamps") else line)
+                return self.send(200, "\n".join(lines).encode(), "text/plain")
+            match = re.match(r"/k8s/clusters/c-\d+/api/v1/namespaces/[^/]+/pods/([^/]+)$", path)
+            if match:
+                return self.send(200, dict(pod(match.group(1)), kind="Pod"))
+            if re.match(r"/k8s/clusters/c-\d+/api/v1/namespaces/[^/]+/pods$", path):
+                return self.send(200, {"kind": "PodList", "metadata": {"resourceVersion": "1"}, "items": [pod(f"istiod-{i}") for i in range(2)]})
+            if path.endswith("/api/v1/query"):
+                result = [{"metric": {"opserver_metric": name}, "value": [0, "12.5"]} for name in ["cpu", "memory", "storage"]]
+                if "label_replace" not in query.get("query", [""])[0]:
+                    result = result[:1]
+                return self.send(200, {"status": "success", "data": {"resultType": "vector", "result": result}})
+            if path.startswith("/k8s") and "/proxy/" in path:
+                return self.send(200, b"<html></html>", "text/html")
+            if path.startswith("/ingress/"):
+                if path.endswith("/api/search"):
+                    return self.send(200, [{"title": "Tester-Status-Neu Rancher / Node"}])
+                return self.send(200, b"<html></html>", "text/html")
+            self.send(404, {"error": path})
+
+    return Handler
+
+
+def serve(port: int, clusters: int, nodes: int, latency: float, errors: float, logLines: int) -> None:
+    '''
+    Entrypoint of the stand-in server process
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler(clusters, nodes, latency, errors, logLines))
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def stats(port: int, reset: bool=False) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats{'?reset=1' if reset else ''}") as response:
+        return json.load(response)
+
+
+def peakRSS() -> float:
+    '''
+    Peak resident set size of this process in MiB
+    '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Fleet-scale benchmark of the QS cycle")
+    parser.add_argument("--clusters", type=int, default=50, help="number of clusters")
+    parser.add_argument("--nodes", type=int, default=20, help="nodes per cluster")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds each response is delayed")
+    parser.add_argument("--errors", type=float, default=0, help="ratio of responses failing with 503")
+    parser.add_argument("--log-lines", type=int, default=200, help="lines of each istiod log")
+    parser.add_argument("--cycles", type=int, default=3, help="QS cycles to run")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrency of the QS")
+    parser.add_argument("--port", type=int, default=18090, help="port of the stand-in server")
+    args = parser.parse_args()
+
+    server = get_context("spawn").Process(target=serve, daemon=True,
+        args=(args.port, args.clusters, args.nodes, args.latency, args.errors, args.log_lines))
+    server.start()
+    for _ in range(50):
+        try:
+            stats(args.port)
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    # imported after the server process is spawned, so its memory does not count
+    import main
+    from analyze import LogWatermarks, TemplateIndex
+    from cache import ResponseCache
+    from clusters import ClusterConfig, K8sCluster
+    from explorer import PrometheusRoutes
+    from httpclient import HTTPClient
+    from manager import ResourceLimits
+
+    base = f"http://127.0.0.1:{args.port}"
+    config = ClusterConfig(clusterURL=f"{base}/v3", apiToken="benchmark", verify=False, concurrency=args.concurrency,
+        clusters=[{"name": f"cluster{i}", "ingress": f"{base}/ingress/cluster{i}", "environment": ["benchmark"]} for i in range(args.clusters)])
+    client = HTTPClient(token=config.apiToken, verify=config.verify, n_clusters=len(config.clusters), concurrency=config.concurrency,
+        cache=ResponseCache(maxBytes=config.cacheSize*1024*1024, ttl=config.cacheTTL))
+    routes = PrometheusRoutes(ttl=config.routeTTL)
+    watermarks = LogWatermarks(sinceSeconds=config.logSince)
+    templates = TemplateIndex(similarity=config.templateSimilarity, maxTemplates=config.maxTemplates)
+
+    print(f"{args.clusters} clusters x {args.nodes} nodes | latency {args.latency}s | errors {args.errors:.1%} | concurrency {args.concurrency}")
+    print(f"{'cycle':>5} |{'seconds':>9} |{'requests':>9} |{'errors':>7} |{'MiB':>9} |{'peak RSS MiB':>13}")
+    sys.stdout.flush()
+    for cycle in range(1, args.cycles + 1):
+        stats(args.port, reset=True)
+        # the QS prints its progress. Only the report goes to stdout
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+        try:
+            start = time.perf_counter()
+            clusters = K8sCluster(config=config, client=client).loadClusters()
+            main.QS(clusters=clusters, config=config, limits=ResourceLimits(), client=client, routes=routes,
+                    watermarks=watermarks, templates=templates, history=main.history).run()
+            elapsed = time.perf_counter() - start
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        served = stats(args.port)
+        print(f"{cycle:>5} |{elapsed:>9.2f} |{served['requests']:>9} |{served['errors']:>7} |{served['bytes']/1024/1024:>9.2f} |{peakRSS():>13.1f}")
+        sys.stdout.flush()
+
+    server.terminate()
+    server.join()
@@ -1,56 +1,563 @@
 
 
 
-from typing import List
-from collections import Counter
+from typing import Iterable, List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from heapq import nlargest
+from operator import itemgetter
+from queue import Queue, Empty, Full
+from urllib.parse import quote, unquote
+import gzip
+import io
+import json
 import os
+import re
+import threading
+import time
+import uuid
 import boto3
-import json
+from prometheus_client import Counter, Gauge
+
+
+c_logsave = Counter("opserver_logsave", "Records and uploads of the background uploader by result", ['result'])
+g_analysis = Gauge("opserver_analysis_batches", "Log batches queued or analysed in the analysis processes")
+c_analysis_restarts = Counter("opserver_analysis_restarts", "Restarts of the analysis processes after one of them died")
 
 
 class LogSave():
-    def __init__(self, tempFile:str, bucket:str="plattform-services/opserver"):
-        if not os.path.isabs(tempFile):
-            raise Exception
-        self.__file = tempFile
-        self.bucket = bucket
-        self.s3 = boto3.client(
+    '''Background S3 Uploader
+
+    Records are queued by `write` and uploaded by a worker thread as gzip compressed NDJSON objects, once `batchBytes`
+    of records are gathered or `interval` seconds after the first record of a batch. Failed uploads are retried with
+    exponential backoff. While S3 is unreachable, batches are kept in `spillDir` up to `spillBytes`, dropping the
+    oldest, and uploaded again after the next successful upload.
+    The S3 endpoint and credentials are read from `S3_ENDPOINT_URL`, `AWS_ACCESS_KEY_ID` and `AWS_SECRET_ACCESS_KEY`.
+
+    Attributes
+    ----------
+    bucket : str, default: plattform-services/opserver
+        bucket and optional key prefix
+    batchBytes : int, default: 4 MiB
+        uncompressed size of a batch
+    interval : float, default: 60
+        maximum seconds a record waits for its upload
+    spillDir : str, default: None
+        absolute path for batches that could not be uploaded. Without it they are dropped
+    spillBytes : int, default: 64 MiB
+        maximum size of the spilled batches
+    retries : int, default: 3
+        upload attempts before a batch is spilled
+    queueSize : int, default: 10000
+        maximum number of queued records. Further records are dropped
+    '''
+
+    def __init__(self, bucket:str="plattform-services/opserver", batchBytes:int=4*1024*1024, interval:float=60,
+                 spillDir:str=None, spillBytes:int=64*1024*1024, retries:int=3, queueSize:int=10000, s3=None):
+        if spillDir is not None and not os.path.isabs(spillDir):
+            raise ValueError("spillDir must be an absolute path")
+        self.bucket, _, self.prefix = bucket.partition("/")
+        self.__batchBytes = batchBytes
+        self.__interval = interval
+        self.__spillDir = spillDir
+        self.__spillBytes = spillBytes
+        self.__retries = retries
+        self.__queue = Queue(maxsize=queueSize)
+        self.__stop = threading.Event()
+        self.s3 = s3 or boto3.client(
             "s3",
             endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
             aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
             aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"))
+        if spillDir is not None:
+            os.makedirs(spillDir, exist_ok=True)
+        self.__worker = threading.Thread(target=self.__run, name="logsave", daemon=True)
+        self.__worker.start()
+
+    def write(self, data:dict) -> bool:
+        '''
+        Queues a record for the upload. Never blocks
+
+        Returns
+        -------
+        bool
+            False if the queue is full and the record was dropped
+        '''
+        try:
+            self.__queue.put_nowait(data)
+        except Full:
+            c_logsave.labels("dropped").inc()
+            return False
+        c_logsave.labels("queued").inc()
+        return True
+
+    def close(self, timeout:float=10) -> None:
+        '''
+        Uploads the queued records and stops the worker
+        '''
+        self.__stop.set()
+        self.__worker.join(timeout)
+
+    def __run(self) -> None:
+        while not (self.__stop.is_set() and self.__queue.empty()):
+            buffer = io.BytesIO()
+            size = 0
+            with gzip.GzipFile(fileobj=buffer, mode="wb") as archive:
+                deadline = None
+                while size < self.__batchBytes:
+                    timeout = 1 if deadline is None else deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        record = self.__queue.get(timeout=min(timeout, 1))
+                    except Empty:
+                        if self.__stop.is_set():
+                            break
+                        continue
+                    line = json.dumps(record, default=str).encode() + b"\n"
+                    archive.write(line)
+                    size += len(line)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.__interval
+            if size:
+                self.__upload(self.__key(), buffer.getvalue())
+
+    def __key(self) -> str:
+        name = time.strftime("%Y/%m/%d/%H%M%S", time.gmtime()) + f"-{uuid.uuid4().hex[:8]}.ndjson.gz"
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def __put(self, key:str, body:bytes) -> bool:
+        for attempt in range(self.__retries):
+            try:
+                self.s3.put_object(Bucket=self.bucket, Key=key, Body=body,
+                                   ContentType="application/x-ndjson", ContentEncoding="gzip")
+                return True
+            except Exception as e:
+                c_logsave.labels("retried").inc()
+                print(f"Upload of {key} failed ({attempt+1}/{self.__retries}): {e}")
+                if attempt+1 < self.__retries and self.__stop.wait(2**attempt):
+                    # shutting down. Keep the batch instead of waiting
+                    break
+        return False
+
+    def __upload(self, key:str, body:bytes) -> None:
+        if not self.__put(key, body):
+            self.__spill(key, body)
+            return
+        c_logsave.labels("uploaded").inc()
+        self.__drain()
+
+    def __spilled(self) -> List[str]:
+        # file names sort by the time of the batch
+        return sorted(os.listdir(self.__spillDir)) if self.__spillDir else []
+
+    def __spill(self, key:str, body:bytes) -> None:
+        if self.__spillDir is None or len(body) > self.__spillBytes:
+            c_logsave.labels("failed").inc()
+            return
+        files = self.__spilled()
+        size = sum(os.path.getsize(os.path.join(self.__spillDir, f)) for f in files) + len(body)
+        while size > self.__spillBytes and files:
+            oldest = os.path.join(self.__spillDir, files.pop(0))
+            size -= os.path.getsize(oldest)
+            os.remove(oldest)
+            c_logsave.labels("failed").inc()
+        with open(os.path.join(self.__spillDir, quote(key, safe="")), "wb") as f:
+            f.write(body)
+        c_logsave.labels("spilled").inc()
+
+    def __drain(self) -> None:
+        for name in self.__spilled():
+            path = os.path.join(self.__spillDir, name)
+            with open(path, "rb") as f:
+                body = f.read()
+            if not self.__put(unquote(name), body):
+                return
+            os.remove(path)
+            c_logsave.labels("uploaded").inc()
+
+
+def normalizeTimestamp(timestamp: str) -> str:
+    '''
+    Pads the fraction of a RFC3339Nano timestamp to nanoseconds. Normalized timestamps compare as strings.
+    '''
+    timestamp = timestamp.rstrip("Z")
+    seconds, _, fraction = timestamp.partition(".")
+    return f"{seconds}.{fraction:0<9}"
+
+
+class LogWatermarks():
+    '''Log Watermarks
+
+    Remembers the timestamp of the last analysed log line per container, so every log line is analysed once.
+    Containers are identified by cluster, pod, pod UID and container name. A new pod or a renamed container starts with a fresh window.
+
+    Attributes
+    ----------
+    sinceSeconds : int, default: 70
+        window for containers without watermark
+    '''
+    def __init__(self, sinceSeconds: int=70) -> None:
+        self.__sinceSeconds = sinceSeconds
+        self.__marks = {}
+        self.__lock = threading.Lock()
+
+    def get(self, key: tuple) -> tuple[str, int]:
+        '''
+        Returns the watermark and the restart count of a container
+        '''
+        with self.__lock:
+            return self.__marks.get(key, (None, None))
+
+    def params(self, key: tuple) -> dict:
+        '''
+        Query parameters for the next log request of a container
+        '''
+        mark, _ = self.get(key)
+        if mark is None:
+            return {"sinceSeconds": self.__sinceSeconds}
+        # sinceTime has a resolution of seconds. Lines up to the watermark are skipped while reading
+        return {"sinceTime": mark.split(".")[0] + "Z"}
+
+    def update(self, key: tuple, mark: str, restarts: int) -> None:
+        with self.__lock:
+            self.__marks[key] = (mark, restarts)
+
+    def prune(self, clusterId: str, keys: Iterable[tuple]) -> None:
+        '''
+        Forgets the containers of a cluster not in keys, e.g. from deleted pods
+        '''
+        keys = set(keys)
+        with self.__lock:
+            for key in [k for k in self.__marks if k[0] == clusterId and k not in keys]:
+                del self.__marks[key]
+
+    def tail(self, lines: Iterable[str], key: tuple, restarts: int) -> Iterable[str]:
+        '''
+        Filters the lines of a log requested with `timestamps=true` to the lines after the watermark.
+        Strips the timestamps and moves the watermark once all lines are read.
+
+        Params
+        ------
+        lines : Iterable[str]
+            log lines prefixed by a RFC3339Nano timestamp
+        key : tuple
+            the container
+        restarts : int
+            the restart count of the container
+        '''
+        mark, _ = self.get(key)
+        last = mark
+        for line in lines:
+            timestamp, _, log = line.partition(" ")
+            timestamp = normalizeTimestamp(timestamp)
+            if mark is not None and timestamp <= mark:
+                continue
+            last = timestamp
+            yield log
+        self.update(key, last, restarts)
+
+
+class LogTemplate():
+    __slots__ = ("id", "tokens", "counts", "lastSeen")
+
+    def __init__(self, id: int, tokens: List[str]) -> None:
+        self.id = id
+        self.tokens = tokens
+        self.counts = {}
+        self.lastSeen = 0
+
+    @property
+    def template(self) -> str:
+        return " ".join(self.tokens)
+
+
+class TemplateIndex():
+    '''Log Template Index
+
+    Drain-style log template mining. Variable tokens (everything with a digit, e.g. IPs, ports, versions and pod names)
+    are masked. Templates are grouped by token count and first token. A trace joins the most similar template of its group,
+    differing tokens become wildcards. Templates persist across cycles and count their traces per cluster.
+
+    Attributes
+    ----------
+    similarity : float, default: 0.5
+        minimum ratio of equal tokens to join a template
+    maxTemplates : int, default: 500
+        maximum number of templates. The least recently seen template is dropped
+    '''
+    WILDCARD = "<*>"
+    VARIABLE = re.compile(r"\d")
+
+    def __init__(self, similarity: float=0.5, maxTemplates: int=500) -> None:
+        self.__similarity = similarity
+        self.__maxTemplates = maxTemplates
+        self.__groups = {}
+        self.__size = 0
+        self.__nextId = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def __tokenize(self, trace: str) -> List[str]:
+        return [self.WILDCARD if self.VARIABLE.search(token) else token for token in trace.split()]
+
+    def __match(self, group: List[LogTemplate], tokens: List[str]) -> LogTemplate:
+        best, bestScore = None, -1.0
+        for template in group:
+            equal = sum(1 for a, b in zip(template.tokens, tokens) if a == b)
+            score = equal / len(tokens) if tokens else 1.0
+            if score > bestScore:
+                best, bestScore = template, score
+        return best if bestScore >= self.__similarity else None
+
+    def __evict(self) -> None:
+        key, oldest = min(((key, template) for key, group in self.__groups.items() for template in group), key=lambda kt: kt[1].lastSeen)
+        self.__groups[key].remove(oldest)
+        if not self.__groups[key]:
+            del self.__groups[key]
+        self.__size -= 1
+
+    def add(self, trace: str, cluster: str) -> tuple[LogTemplate, bool]:
+        '''
+        Adds a trace to the index
+
+        Params
+        ------
+        trace : str
+            the log message
+        cluster : str
+            the cluster of the trace
+
+        Returns
+        -------
+        tuple[LogTemplate, bool]
+            the matching template and if the template is new for the cluster
+        '''
+        tokens = self.__tokenize(trace)
+        key = (len(tokens), tokens[0] if tokens else "")
+        with self.__lock:
+            group = self.__groups.setdefault(key, [])
+            template = self.__match(group, tokens)
+            if template is None:
+                if self.__size >= self.__maxTemplates:
+                    self.__evict()
+                    group = self.__groups.setdefault(key, group)
+                template = LogTemplate(self.__nextId, tokens)
+                self.__nextId += 1
+                group.append(template)
+                self.__size += 1
+            else:
+                template.tokens = [a if a == b else self.WILDCARD for a, b in zip(template.tokens, tokens)]
+            new = cluster not in template.counts
+            template.counts[cluster] = template.counts.get(cluster, 0) + 1
+            template.lastSeen = time.monotonic()
+            return template, new
+
+    def templates(self, cluster: str=None) -> List[LogTemplate]:
+        '''
+        Returns all templates or the templates seen on a cluster
+        '''
+        with self.__lock:
+            return [t for group in self.__groups.values() for t in group if cluster is None or cluster in t.counts]
+
+
+# frequent words of istiod logs without information
+STOP_WORDS = ["for", "new", "PUSH", "request", "CDS", "RDS", "LDS"]
+
+
+class WordWindow():
+    '''Rolling Word Count
+
+    Counts the words of the last `size` log lines. Pushing a line costs constant time.
+
+    Attributes
+    ----------
+    size : int, default: 10
+        number of lines in the window
+    stopWords : Iterable[str], default: STOP_WORDS
+        words not counted
+    '''
+    def __init__(self, size: int=10, stopWords: Iterable[str]=None) -> None:
+        self.__size = size
+        self.__stopWords = frozenset(stopWords if stopWords is not None else STOP_WORDS)
+        self.__lines = deque()
+        self.__counts = {}
+
+    def push(self, trace: str) -> None:
+        '''
+        Adds the words of a trace and drops the oldest line if the window is full
+        '''
+        stopWords = self.__stopWords
+        counts = self.__counts
+        words = [w for w in trace.split() if w not in stopWords]
+        self.__lines.append(words)
+        for word in words:
+            counts[word] = counts.get(word, 0) + 1
+        if len(self.__lines) > self.__size:
+            for word in self.__lines.popleft():
+                count = counts[word] - 1
+                if count:
+                    counts[word] = count
+                else:
+                    del counts[word]
+
+    def mostCommon(self, nFrequent: int=5) -> dict:
+        return dict(nlargest(nFrequent, self.__counts.items(), key=itemgetter(1)))
 
-    def write(self, data:dict, file:str):
-        with open(self.__file, "w") as f:
-            json.dump(data, f)
-        self.s3.upload_fileobj(self.__file, self.bucket, file)
 
 class IstioDAnalyze():
-    def __init__(self, logs:List[str]):
-        self.__logs = logs
+    '''Istiod Log Analyzer
 
-    def __mostFrequentWords(self, logs: List[str], nFrequent:int=5):
-        trace = [log.split("\t")[-1] for log in logs]
-        words = " ".join(trace).split()
-        mostCommonNotUsed = ["for", "new", "PUSH", "request", "CDS", "RDS", "LDS"]
-        words = [w for w in words if w not in mostCommonNotUsed]
-        mfw = Counter(words)
-        return dict(mfw.most_common(nFrequent))
+    Attributes
+    ----------
+    logs : Iterable[str]
+        the istiod log lines
+    window : int, default: 10
+        number of previous lines for the most frequent words of a warning
+    stopWords : Iterable[str], default: STOP_WORDS
+        words ignored for the most frequent words
+    context : Iterable[str], default: ()
+        the log lines before `logs`. They fill the word window but are not analyzed
+    '''
+    def __init__(self, logs:Iterable[str], window: int=10, stopWords: Iterable[str]=None, context: Iterable[str]=()):
+        self.__logs = logs
+        self.__window = window
+        self.__stopWords = stopWords
+        self.__context = context
 
     def analyze(self) -> List[dict]:
+        '''
+        Analyzes the logs line by line. Only the words of the last lines are kept in memory.
+        '''
         logs = []
-        for index, log in enumerate(self.__logs):
+        window = WordWindow(self.__window, self.__stopWords)
+        for log in self.__context:
+            window.push(log.split("\t")[-1])
+        for log in self.__logs:
             splash = log.split("\t")
-            if len(splash) <= 3:
-                continue
-            if splash[1].lower() in ["warn", "error"]:
-                mfw = self.__mostFrequentWords(self.__logs[index-10:index])
+            if len(splash) > 3 and splash[1].lower() in ["warn", "error"]:
                 logs.append({
                     "trace": splash[-1], 
-                    "mfw": mfw,
+                    "mfw": window.mostCommon(),
                     "time": splash[0],
                     "type": splash[1].lower()
                 })
+            window.push(splash[-1])
         return logs
 
-        
\ No newline at end of file
+
+def analyzeBatch(batch: str, context: str, window: int, stopWords: List[str]) -> List[dict]:
+    '''
+    Entrypoint of the analysis processes. The lines of the batch and its context are joined by newlines
+    '''
+    return IstioDAnalyze(logs=batch.split("\n"), window=window, stopWords=stopWords, context=context.split("\n") if context else ()).analyze()
+
+
+class AnalysisPool():
+    '''Process Pool for the Log Analysis
+
+    Splits a log into batches of `batchLines` lines and analyzes them in separate processes, so large logs do not hold
+    the GIL of the checks and the API. Each batch carries the last `window` lines before it, so the most frequent words
+    are the same as in one pass, except for the choice among equally frequent words. A batch is sent as one newline
+    joined string.
+    At most `queueSize` batches are queued or analysed at once. Further batches wait, which bounds the memory while the
+    logs are read. Without workers the logs are analyzed in the calling thread. If an analysis process dies, its batches
+    are analyzed in the calling thread and the processes are restarted.
+
+    Attributes
+    ----------
+    workers : int, default: 0
+        number of analysis processes. 0 analyzes inline
+    queueSize : int, default: 4
+        maximum number of batches queued or analysed at once
+    batchLines : int, default: 5000
+        log lines per batch
+    '''
+
+    def __init__(self, workers: int=0, queueSize: int=4, batchLines: int=5000) -> None:
+        self.__batchLines = batchLines
+        self.__workers = workers
+        self.__pool = self.__start() if workers > 0 else None
+        self.__slots = threading.BoundedSemaphore(max(queueSize, 1))
+        self.__lock = threading.Lock()
+
+    def __start(self) -> ProcessPoolExecutor:
+        # the QS process runs threads. Forking them is not safe
+        return ProcessPoolExecutor(max_workers=self.__workers, mp_context=get_context("spawn"))
+
+    def __restart(self, broken: ProcessPoolExecutor) -> None:
+        '''
+        Replaces a broken pool. Threads that ran into the same broken pool restart it once
+        '''
+        with self.__lock:
+            if self.__pool is not broken:
+                return
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.__pool = self.__start()
+        c_analysis_restarts.inc()
+        print("An analysis process died. The analysis processes are restarted")
+
+    def close(self) -> None:
+        if self.__pool is not None:
+            self.__pool.shutdown(cancel_futures=True)
+
+    def __release(self, future) -> None:
+        g_analysis.dec()
+        self.__slots.release()
+
+    def __submit(self, pool: ProcessPoolExecutor, batch: List[str], context: List[str], window: int, stopWords: List[str]):
+        self.__slots.acquire()
+        g_analysis.inc()
+        try:
+            future = pool.submit(analyzeBatch, "\n".join(batch), "\n".join(context), window, stopWords)
+        except BaseException:
+            self.__release(None)
+            raise
+        future.add_done_callback(self.__release)
+        return future
+
+    def analyze(self, logs: Iterable[str], window: int=10, stopWords: Iterable[str]=None) -> List[dict]:
+        '''
+        Analyzes the log lines like `IstioDAnalyze.analyze`. The results are in the order of the lines
+        '''
+        if self.__pool is None:
+            return IstioDAnalyze(logs=logs, window=window, stopWords=stopWords).analyze()
+        stopWords = list(stopWords) if stopWords is not None else None
+        splashes = []
+        # batches in the pool. A batch is kept until its result is collected
+        pending = deque()
+
+        def collect(wait: bool) -> None:
+            while pending and (wait or pending[0][0].done()):
+                future, pool, batch, context = pending.popleft()
+                try:
+                    splashes.extend(future.result())
+                except BrokenProcessPool:
+                    # an analysis process died. The batch is analyzed here
+                    self.__restart(pool)
+                    splashes.extend(IstioDAnalyze(logs=batch, window=window, stopWords=stopWords, context=context).analyze())
+
+        def dispatch(batch: List[str], context: List[str]) -> None:
+            pool = self.__pool
+            try:
+                pending.append((self.__submit(pool, batch, context, window, stopWords), pool, batch, context))
+            except BrokenProcessPool:
+                self.__restart(pool)
+                collect(True)
+                splashes.extend(IstioDAnalyze(logs=batch, window=window, stopWords=stopWords, context=context).analyze())
+
+        batch, context = [], []
+        for log in logs:
+            batch.append(log)
+            if len(batch) >= self.__batchLines:
+                dispatch(batch, context)
+                batch, context = [], batch[-window:] if window else []
+                collect(False)
+        if batch:
+            dispatch(batch, context)
+        collect(True)
+        return splashes
@@ -0,0 +1,107 @@
+#!/bin/python
+
+from collections import OrderedDict
+from typing import Optional
+import threading
+import time
+from requests import Response
+from prometheus_client import Counter
+
+
+c_cache = Counter("opserver_http_cache", "Cached GET requests by result", ['result'])
+c_cache_saved = Counter("opserver_http_cache_saved_bytes", "Response bytes not downloaded thanks to the cache")
+
+
+class CacheEntry():
+    __slots__ = ("content", "headers", "etag", "lastModified", "ttl", "stored")
+
+    def __init__(self, response: Response, ttl: bool) -> None:
+        self.content = response.content
+        self.headers = {"Content-Type": response.headers.get("Content-Type", "application/json")}
+        self.etag = response.headers.get("ETag")
+        self.lastModified = response.headers.get("Last-Modified")
+        self.ttl = ttl
+        self.stored = time.monotonic()
+
+    def response(self, url: str) -> Response:
+        '''
+        Builds a Response from the cached content
+        '''
+        response = Response()
+        response.status_code = 200
+        response.url = url
+        response._content = self.content
+        response.headers.update(self.headers)
+        return response
+
+
+class ResponseCache():
+    '''Response Cache for GET requests
+
+    LRU Cache bounded by the size of the cached bodies. Entries are revalidated with ETag/If-None-Match and
+    Last-Modified/If-Modified-Since where the API sends them. Responses stored with `ttl` are served for `ttl` seconds
+    without asking the server. Other responses without validators are not stored.
+
+    Attributes
+    ----------
+    maxBytes : int, default: 16 MiB
+        maximum size of all cached bodies
+    ttl : float, default: 120
+        seconds an entry stored with `ttl` is served without asking the server. 0 disables the fallback
+    '''
+
+    def __init__(self, maxBytes: int=16*1024*1024, ttl: float=120) -> None:
+        self.__maxBytes = maxBytes
+        self.__ttl = ttl
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                self.__entries.move_to_end(key)
+            return entry
+
+    def fresh(self, entry: CacheEntry) -> bool:
+        return entry.ttl and time.monotonic() - entry.stored < self.__ttl
+
+    def put(self, key: str, response: Response, ttl: bool=False) -> bool:
+        '''
+        Stores a response that can be revalidated, or with `ttl` is served for the TTL. Returns True if it was stored
+        '''
+        ttl = ttl and self.__ttl > 0
+        if not ttl and "ETag" not in response.headers and "Last-Modified" not in response.headers:
+            return False
+        entry = CacheEntry(response, ttl)
+        if len(entry.content) > self.__maxBytes:
+            return False
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.__size -= len(old.content)
+            self.__entries[key] = entry
+            self.__size += len(entry.content)
+            while self.__size > self.__maxBytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__size -= len(evicted.content)
+        return True
+
+    def refresh(self, entry: CacheEntry) -> None:
+        entry.stored = time.monotonic()
+
+    def validators(self, entry: CacheEntry) -> dict:
+        '''
+        Returns the headers to revalidate an entry
+        '''
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.lastModified:
+            headers["If-Modified-Since"] = entry.lastModified
+        return headers
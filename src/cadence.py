@@ -0,0 +1,85 @@
+#!/bin/python
+
+from typing import Any, Callable, Dict
+from zlib import crc32
+import math
+import threading
+import time
+from requests.exceptions import RequestException
+from clusters import Cluster
+from faillog import QSLog, Severity
+from httpclient import Skipped
+from metrics import timed
+
+
+class Cadence():
+    '''Check Intervals
+
+    Decides which checks are due in a QS cycle. Each check runs once per `interval` seconds, at the first cycle after its
+    slot starts. The slots of a check are shifted by a stable phase per cluster, so an expensive check does not run on
+    all clusters in the same cycle. Checks run at most once per cycle and right away on the first cycle.
+
+    Attributes
+    ----------
+    intervals : Dict[str, float], default: None
+        seconds between two runs per check. Checks without an interval run every cycle
+    '''
+
+    def __init__(self, intervals: Dict[str, float]=None) -> None:
+        self.__intervals = intervals or {}
+        self.__slots = {}
+        self.__lock = threading.Lock()
+
+    def phase(self, cluster: str, check: str) -> float:
+        '''
+        Offset of the slots of a check on a cluster in seconds
+        '''
+        interval = self.__intervals.get(check, 0)
+        return crc32(f"{cluster}/{check}".encode()) % 1000 / 1000 * interval
+
+    def due(self, cluster: str, check: str, now: float=None) -> bool:
+        '''
+        Returns True if the check has not run in its current slot and marks it as run
+        '''
+        interval = self.__intervals.get(check, 0)
+        if interval <= 0:
+            return True
+        now = time.time() if now is None else now
+        slot = math.floor((now - self.phase(cluster, check)) / interval)
+        with self.__lock:
+            if self.__slots.get((cluster, check)) == slot:
+                return False
+            self.__slots[(cluster, check)] = slot
+            return True
+
+
+def runCheck(step: str, cadence: Cadence, log: QSLog, cluster: Cluster, check: str, run: Callable[[], Any]) -> None:
+    '''
+    Runs a check if it is due within the budget of the cluster and observes its duration. A skipped or failed request
+    fails the check. A check that is not due is marked in the log, so its previous results are carried
+
+    Params
+    ------
+    step : str
+        the step of the QS running the check, e.g. manager
+    cadence : Cadence
+        intervals of the checks. None runs every check
+    log : QSLog
+        the log of the run
+    cluster : Cluster
+        the cluster to check
+    check : str
+        the name of the check
+    run : Callable[[], Any]
+        runs the check
+    '''
+    if cadence is not None and not cadence.due(cluster.name, check):
+        log.notDue(cluster.name, check)
+        return
+    with cluster.budget, timed(step, check, cluster.name), log.running(check):
+        try:
+            run()
+        except Skipped as e:
+            log.event(Severity.FAILED, cluster.name, check, f"Cluster {cluster.name} {check} skipped: {e}")
+        except RequestException as e:
+            log.event(Severity.FAILED, cluster.name, check, f"Cluster {cluster.name} {check} failed: {e}")
@@ -1,19 +1,53 @@
 #!/bin/python
 
-from typing import List
-from requests import get
-from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Union
+from dataclasses import dataclass, field, InitVar
+from httpclient import Budget, HTTPClient, Skipped
+from sharding import ordinal
 import os
+import threading
 
 
 @dataclass
 class Cluster():
+    '''Cluster Inventory
+
+    Resolved once per cycle and shared by all QS steps. Nodes and the System project are loaded lazily on first access.
+    '''
     name:str # Name
     id: str # Rancher ClusterID
     state: str # State
-    n_nodes: int # number of Nodes
     environment: List[str] # Description of the cluster location. Can be used afterwards...
     base: str # Ingress Base Domain für Dinge auf dem Cluster
+    loader: InitVar[Callable[[str], Any]] = None # GET on the Rancher v3 API
+    budget: Budget = field(default_factory=Budget, repr=False) # time budget of the checks in this cycle
+
+    def __post_init__(self, loader):
+        self.__loader = loader
+        self.__lock = threading.Lock()
+        self.__inventory = {}
+
+    def __load(self, path: str) -> Any:
+        with self.__lock:
+            if path not in self.__inventory:
+                self.__inventory[path] = self.__loader(path) if self.__loader else None
+            return self.__inventory[path]
+
+    @property
+    def nodes(self) -> list:
+        '''the nodes of the cluster. None if not reachable'''
+        return self.__load(f"/clusters/{self.id}/nodes")
+
+    @property
+    def n_nodes(self) -> int:
+        '''number of Nodes'''
+        return len(self.nodes or [])
+
+    @property
+    def systemProjectId(self) -> str:
+        '''the ID of Rancher Project System. None if not reachable'''
+        projects = self.__load(f"/clusters/{self.id}/projects?name=System")
+        return projects[0]["id"] if projects else None
 
 @dataclass
 class ClusterConfigCluster():
@@ -30,14 +64,80 @@ class ClusterConfig():
     debug: bool = False
     proxy: bool = True
     verify: bool = True
+    concurrency: int = 1
+    routeTTL: float = 600
+    cacheSize: int = 16
+    cacheTTL: float = 120
+    daemonsets: Dict[str, Union[str, int]] = None
+    logSince: int = 70
+    logWindow: int = 10
+    stopWords: List[str] = None
+    templateSimilarity: float = 0.5
+    maxTemplates: int = 500
+    historySize: int = 1440
+    database: str = None
+    databaseRetention: int = 7
+    bucket: str = None
+    uploadInterval: float = 60
+    spillDir: str = None
+    spillSize: int = 16
+    apiThreads: int = 4
+    apiTimeout: int = 30
+    apiProcess: bool = False
+    apiSharedMemory: int = 8
+    interval: float = 60
+    schedule: str = "rate"
+    jitter: float = 0
+    overrun: str = "skip"
+    checkIntervals: Dict[str, float] = None
+    metricsLabelLimit: int = 100
+    debugToken: str = field(default=None, repr=False)
+    requestTimeout: float = 10
+    clusterBudget: float = 0
+    breakerThreshold: int = 3
+    breakerBackoff: float = 60
+    breakerMaxBackoff: float = 900
+    apiPort: int = 8080
+    shardIndex: int = None
+    shardCount: int = 1
+    shardPeers: List[str] = None
+    analysisWorkers: int = 0
+    analysisQueue: int = 4
 
     def __post_init__(self):
+        if os.getenv("DEBUG_TOKEN"):
+            self.debugToken = os.getenv("DEBUG_TOKEN")
         # check if env-api-token is set
         if os.getenv("API_TOKEN"):
             self.apiToken = os.getenv("API_TOKEN")
         # if not set here or as env -> Throw error
         if self.apiToken == "":
             raise ValueError("No API_TOKEN is set! Please use environment or config.yaml")
+        if self.concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if self.historySize < 1:
+            raise ValueError("historySize must be at least 1")
+        if self.apiThreads < 1:
+            raise ValueError("apiThreads must be at least 1")
+        if self.requestTimeout <= 0:
+            raise ValueError("requestTimeout must be positive")
+        if os.getenv("API_PORT"):
+            self.apiPort = int(os.getenv("API_PORT"))
+        if os.getenv("SHARD_COUNT"):
+            self.shardCount = int(os.getenv("SHARD_COUNT"))
+        if os.getenv("SHARD_INDEX"):
+            self.shardIndex = int(os.getenv("SHARD_INDEX"))
+        if os.getenv("SHARD_PEERS"):
+            self.shardPeers = [peer for peer in os.getenv("SHARD_PEERS").split(",") if peer]
+        if self.analysisWorkers < 0:
+            raise ValueError("analysisWorkers must not be negative")
+        if self.shardCount < 1:
+            raise ValueError("shardCount must be at least 1")
+        # the pods of a StatefulSet are numbered by their ordinal index
+        if self.shardCount > 1 and self.shardIndex is None:
+            self.shardIndex = ordinal(os.getenv("HOSTNAME"))
+        if self.shardCount > 1 and (self.shardIndex is None or not 0 <= self.shardIndex < self.shardCount):
+            raise ValueError("shardIndex must be between 0 and shardCount-1. Set SHARD_INDEX or run as StatefulSet")
 
 @dataclass
 class ClusterType():
@@ -59,20 +159,32 @@ class K8sCluster():
 
     Attributes
     ----------
-    url: str
-        The Cluster Upstream URL
-    token: str
-        Bearer-Token for Authentification
-    debug_ : bool, default: False
-        Debug Functions
-    legacy : bool, default: False
-        Accept Legacy Cluster "Vermittlung"
+    config: ClusterConfig
+        The QS Configuration
+    client: HTTPClient
+        The shared HTTP Client
     '''
 
-    def __init__(self, config: ClusterConfig, clusterType: ClusterType=ClusterType(name="rancher")) -> None: # path: str="/config/clusters.yaml"
+    def __init__(self, config: ClusterConfig, client: HTTPClient, clusterType: ClusterType=ClusterType(name="rancher")) -> None: # path: str="/config/clusters.yaml"
         self.__config = config
+        self.__client = client
         self.__clusters = [c["name"] for c in config.clusters]
 
+    def __get(self, path:str) -> Any:
+        '''
+        GET on the Rancher v3 API. Returns the data or None. The rarely changing lists are cached for `cacheTTL`
+        '''
+        try:
+            response = self.__client.get(f"{self.__config.clusterURL}{path}", cache=True, ttl=True)
+            if response.status_code == 200:
+                data = response.json()
+                return data.get("data", data)
+        except Skipped:
+            raise
+        except Exception as e:
+            print(e)
+        return None
+
     def __get_cluster(self, clusterName:str) -> dict :
         return next(item for item in self.__config.clusters if item["name"] == clusterName)
 
@@ -91,7 +203,7 @@ class K8sCluster():
         print(f'environment = {self.__clusters}')
         print("------******------")
         try:
-            response = get(f"{self.__config.clusterURL}/clusters", headers={"Authorization": f"Bearer {self.__config.apiToken}"}, timeout=2, verify=self.__config.verify) #self.__debug
+            response = self.__client.get(f"{self.__config.clusterURL}/clusters", cache=True, ttl=True, timeout=2)
             print("---init---\n self.__url:",self.__config.clusterURL,"\n self.__token:", self.__config.apiToken, "\nself.__qs:",self.__clusters, "\n self.__debug:",self.__config.debug )
             if self.__config.debug:
                 print(response)
@@ -101,16 +213,13 @@ class K8sCluster():
                 for c in clusters:
                     name = c["name"]
                     if any([s == name for s in self.__clusters]):
-                        cluster_id = c["id"]
-                        # get current nodes....
-                        response_nodes = get(f"{self.__config.clusterURL}/clusters/{cluster_id}/nodes", headers={"Authorization": f"Bearer {self.__config.apiToken}"}, timeout=2, verify=self.__config.verify) #self.__debug
-                        n_nodes = len(response_nodes.json().get("data"))
                         c_ = Cluster(name=c["name"], 
-                                     id= cluster_id, 
+                                     id= c["id"], 
                                      state= c["state"],
-                                     n_nodes= n_nodes,
                                      environment=self.__get_cluster(name)["environment"],
-                                     base = self.__get_cluster(name)["ingress"])
+                                     base = self.__get_cluster(name)["ingress"],
+                                     loader=self.__get,
+                                     budget=Budget(name, self.__config.clusterBudget))
                         qsClusters.append(c_)
                 print('qsClusters:', qsClusters)
                 return qsClusters
@@ -0,0 +1,147 @@
+#!/bin/python
+
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+import cProfile
+import functools
+import io
+import pstats
+import threading
+import tracemalloc
+
+
+KINDS = ("profile", "memory")
+SORTS = ("cumulative", "tottime", "calls")
+
+
+class DebugRequest():
+    '''A pending profile or memory trace over the next cycles'''
+    __slots__ = ("kind", "remaining", "top", "sort", "profiles", "before", "result", "done")
+
+    def __init__(self, kind: str, cycles: int, top: int, sort: str) -> None:
+        self.kind = kind
+        self.remaining = cycles
+        self.top = top
+        self.sort = sort
+        self.profiles: List[cProfile.Profile] = []
+        self.before: Optional[tracemalloc.Snapshot] = None
+        self.result: Optional[str] = None
+        self.done = threading.Event()
+
+
+class CycleProfiler():
+    '''On-demand Profiler of QS cycles
+
+    The API requests a profile or a memory trace of the next cycles and waits for the result. The cycles are only
+    instrumented while a request is pending. Otherwise `cycle` and `thread` cost one attribute lookup.
+
+    Attributes
+    ----------
+    interval : float, default: 60
+        seconds between cycles. Bounds the time a request waits
+    '''
+
+    def __init__(self, interval: float=60) -> None:
+        self.__interval = interval
+        self.__pending: Optional[DebugRequest] = None
+        self.__lock = threading.Lock()
+
+    def request(self, kind: str, cycles: int=1, top: int=30, sort: str="cumulative") -> str:
+        '''
+        Instruments the next cycles and returns the report
+
+        Raises
+        ------
+        ValueError
+            invalid parameters
+        RuntimeError
+            another request is pending
+        TimeoutError
+            the cycles did not finish in time
+        '''
+        if kind not in KINDS or sort not in SORTS or not 1 <= cycles <= 10 or top < 1:
+            raise ValueError(f"kind must be one of {KINDS}, sort one of {SORTS}, cycles between 1 and 10")
+        request = DebugRequest(kind, cycles, top, sort)
+        with self.__lock:
+            if self.__pending is not None:
+                raise RuntimeError("another debug request is running")
+            self.__pending = request
+        if not request.done.wait((cycles + 1) * self.__interval + 300):
+            with self.__lock:
+                if self.__pending is request:
+                    self.__pending = None
+            if request.kind == "memory" and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            raise TimeoutError("the cycles did not finish in time")
+        return request.result
+
+    @contextmanager
+    def cycle(self):
+        '''
+        Instruments a cycle if a request is pending
+        '''
+        request = self.__pending
+        if request is None:
+            yield
+            return
+        failed = True
+        try:
+            if request.kind == "profile":
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    yield
+                finally:
+                    profile.disable()
+                    request.profiles.append(profile)
+            else:
+                if request.before is None:
+                    tracemalloc.start()
+                    request.before = tracemalloc.take_snapshot()
+                yield
+            failed = False
+        finally:
+            if failed:
+                # a failed cycle ends the request with the report so far. tracemalloc must not keep running
+                self.__finish(request)
+        request.remaining -= 1
+        if request.remaining == 0:
+            self.__finish(request)
+
+    def thread(self, func: Callable) -> Callable:
+        '''
+        Profiles a function running in a worker thread of a profiled cycle
+        '''
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            request = self.__pending
+            if request is None or request.kind != "profile":
+                return func(*args, **kwargs)
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # the profiler of the cycle already covers all threads
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self.__lock:
+                    request.profiles.append(profile)
+        return wrapper
+
+    def __finish(self, request: DebugRequest) -> None:
+        output = io.StringIO()
+        if request.kind == "profile":
+            stats = pstats.Stats(*request.profiles, stream=output)
+            stats.sort_stats(request.sort).print_stats(request.top)
+        else:
+            after = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            for stat in after.compare_to(request.before, "lineno")[:request.top]:
+                print(stat, file=output)
+        request.result = output.getvalue()
+        with self.__lock:
+            self.__pending = None
+        request.done.set()
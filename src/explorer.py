@@ -2,21 +2,79 @@
 
 from json.decoder import JSONDecodeError
 from typing import Any, List
+import threading
+import time
+from prometheus_client import Gauge
 from clusters import Cluster
-from requests import get
-from faillog import QSLog
+from httpclient import HTTPClient, Skipped
+from cadence import Cadence, runCheck
+from faillog import QSLog, Severity
+
+
+g_route = Gauge("opserver_prometheus_route", "Prometheus route used per cluster", ['cluster', 'route'])
+
+
+class PrometheusRoutes():
+    '''Prometheus Route Cache
+
+    Remembers per cluster, if Prometheus is reachable via the ingress (standard) or the Rancher proxy.
+    A remembered route is used exclusively until it fails or expires. Expired routes are probed again starting with the standard route.
+
+    Attributes
+    ----------
+    ttl : float, default: 600
+        seconds until a working route is probed again
+    '''
+    ROUTES = ("standard", "proxy")
+
+    def __init__(self, ttl: float=600) -> None:
+        self.__ttl = ttl
+        self.__routes = {}
+        self.__lock = threading.Lock()
+
+    def get(self, clusterId: str) -> str:
+        '''
+        Returns the remembered route of a cluster or None if unknown or expired
+        '''
+        with self.__lock:
+            route, since = self.__routes.get(clusterId, (None, 0))
+        if route and time.monotonic() - since < self.__ttl:
+            return route
+        return None
+
+    def order(self, clusterId: str) -> List[str]:
+        '''
+        Returns the routes to try in order
+        '''
+        route = self.get(clusterId)
+        if route:
+            return [route] + [r for r in self.ROUTES if r != route]
+        return list(self.ROUTES)
+
+    def set(self, clusterName: str, clusterId: str, route: str) -> None:
+        with self.__lock:
+            if self.__routes.get(clusterId, (None,))[0] == route:
+                return
+            self.__routes[clusterId] = (route, time.monotonic())
+        for r in self.ROUTES:
+            g_route.labels(clusterName, r).set(int(r == route))
+
+    def invalidate(self, clusterId: str) -> None:
+        with self.__lock:
+            self.__routes.pop(clusterId, None)
 
 
 class Dashboard():
-    def __init__(self, url: str, token: str, log: QSLog, proxy:bool=False, debug_:bool=False, verify:bool=False) -> None:
+    def __init__(self, url: str, client: HTTPClient, log: QSLog, routes: PrometheusRoutes, proxy:bool=False, debug_:bool=False, cadence:Cadence=None) -> None:
         self.__url = url.replace("/v3","/")
-        self.__token = token
+        self.__cadence = cadence
+        self.__client = client
         self.__log = log
+        self.__routes = routes
         self.proxy=proxy
         self.__debug = debug_
-        self.__verify = verify
 
-    def get_RAW(self, url:str, params:dict={}, auth:bool=True) -> list[str,Any]:
+    def get_RAW(self, url:str, params:dict={}, auth:bool=True) -> list[Severity,Any]:
         '''
         Sends a RAW request to the supplied url and takes optional params
 
@@ -29,33 +87,82 @@ class Dashboard():
 
         Returns
         -------
-        List[str, Any]
-            First Part containing formatted output, second part the Response Status Code or JSON Data. Depending on if there is some JSON Data, or not.
+        List[Severity, Any]
+            First Part containing the Severity, second part the Response Status Code or JSON Data. Depending on if there is some JSON Data, or not.
+
+        Raises
+        ------
+        Skipped
+            the request was skipped by the circuit breaker or the cluster budget
         '''
         try:
             if self.__debug:
                 print(f"GET {url} [{auth=}, {params=}]")
-            if auth:
-                response = get(url=url, headers={"Authorization": "Bearer {}".format(self.__token)}, params=params, verify=self.__verify)
-            else:
-                response = get(url=url, params=params, verify=self.__verify)
+            response = self.__client.get(url=url, params=params, auth=auth)
             data = response.json()
             response = response.status_code
         except JSONDecodeError:
             data = None
             response = response.status_code
+        except Skipped:
+            raise
         except:
             # Failover
             data = None
             response = "ConnectionError"
-            return ["[\033[0;31mFailed\033[0m]", response]
+            return [Severity.FAILED, response]
         if response == 200:
-            return ["[ \033[0;32mOK\033[0m ]\t", data if data else response]
+            return [Severity.OK, data if data else response]
         # extract 500+ as warning -> bad Gateway -> fixable
         elif response%400 > 99:
-            return ["[ \033[1;33mWARN\033[0m ]", response]
+            return [Severity.WARN, response]
         else:
-            return ["[\033[0;31mFailed\033[0m]", response]
+            return [Severity.FAILED, response]
+
+    def __prometheusURL(self, cluster:Cluster, route:str, path:str) -> str:
+        if route == "proxy":
+            return f'{self.__url}/k8s/clusters/{cluster.id}/api/v1/namespaces/cattle-monitoring-system/services/http:rancher-monitoring-prometheus:9090/proxy/{path}'
+        return f'{cluster.base}/monitoring/prometheus/{path}'
+
+    def get_PrometheusRoute(self, cluster:Cluster, path:str, params:dict={}) -> tuple[list[str,Any], str]:
+        '''
+        Requests the Prometheus API on the remembered route. Falls back to the other route and remembers the working one.
+        A route works if it answers with a JSON object.
+
+        Params
+        ------
+        cluster : Cluster
+            the cluster to scrape from
+        path : str
+            the Prometheus path, e.g. api/v1/query
+        params : dict, default: {}
+            additional paramters for searching the API
+
+        Returns
+        -------
+        tuple[list, str]
+            the response of get_RAW and the working route. The route is None if no route worked
+
+        Raises
+        ------
+        Skipped
+            the requests on all routes were skipped
+        '''
+        response, skipped = None, None
+        for route in self.__routes.order(cluster.id):
+            try:
+                response = self.get_RAW(url=self.__prometheusURL(cluster, route, path), params=params, auth=route == "proxy")
+            except Skipped as e:
+                skipped = e
+                continue
+            # a 200 without a JSON body is a login or error page of the ingress
+            if isinstance(response[1], dict):
+                self.__routes.set(cluster.name, cluster.id, route)
+                return response, route
+            self.__routes.invalidate(cluster.id)
+        if response is None and skipped is not None:
+            raise skipped
+        return response, None
 
     def get_Prometheus(self, cluster:Cluster) -> None:
         '''
@@ -73,31 +180,56 @@ class Dashboard():
         memory_query = '(1 - sum({__name__=~"node_memory_MemAvailable_bytes|windows_os_physical_memory_free_bytes"}) / sum({__name__=~"node_memory_MemTotal_bytes|windows_cs_physical_memory_bytes"})) * 100'
         storage_query = '(1 - (((sum(node_filesystem_free_bytes{device!~"rootfs|HarddiskVolume.+"}) OR on() vector(0)) + (sum(windows_logical_disk_free_bytes{volume!~"(HarddiskVolume.+|[A-Z]:.+)"}) OR on() vector(0))) / ((sum(node_filesystem_size_bytes{device!~"rootfs|HarddiskVolume.+"}) OR on() vector(0)) + (sum(windows_logical_disk_size_bytes{volume!~"(HarddiskVolume.+|[A-Z]:.+)"}) OR on() vector(0))))) * 100'
         __path="api/v1/query"
-        promURL = {
-            'proxy': f'{self.__url}/k8s/clusters/{cluster.id}/api/v1/namespaces/cattle-monitoring-system/services/http:rancher-monitoring-prometheus:9090/proxy/{__path}',
-            'standard': f'{cluster.base}/monitoring/prometheus/{__path}'}
-        queries = [("cpu", cpu_query), ("memory", memory_query), ("storage", storage_query)]
-        output_log = ["[ \033[0;32mOK\033[0m ]\t"]
-        used_proxy = ""
-        for name, query in queries:
-            # try standard url. If Failing. Try Proxy
-            url = promURL['standard']
-            response = self.get_RAW(url=url, params={"query": query}, auth=False)
-            if not isinstance(response[1], dict):
-                url = promURL['proxy']
-                used_proxy = "[used rancher proxy]"
-                response = self.get_RAW(url=url, params={"query": query})
-                if not isinstance(response[1], dict):
-                    output_log[0] = "[\033[0;31mFailed\033[0m]"
-                    output_log.append("xx")
-                    continue
-            stat = round(float(response[1].get("data").get("result")[0].get("value")[1]),2)
+        queries = {"cpu": cpu_query, "memory": memory_query, "storage": storage_query}
+        # one request for all queries. Each series is tagged by the label opserver_metric
+        query = " or ".join(f'label_replace({q}, "opserver_metric", "{name}", "", "")' for name, q in queries.items())
+        severity = Severity.OK
+        stats, high = [], []
+        response, route = self.get_PrometheusRoute(cluster, __path, params={"query": query})
+        results = {}
+        if isinstance(response[1], dict):
+            for series in response[1].get("data", {}).get("result", []):
+                results[series.get("metric", {}).get("opserver_metric")] = series.get("value")[1]
+        for name in queries:
+            if name not in results:
+                severity = Severity.FAILED
+                stats.append("xx")
+                continue
+            stat = round(float(results[name]),2)
             if stat>65:
-                output_log[0] = "[ \033[1;33mWARN\033[0m ]\t\t {} failed QS inspection".format(name)
-            output_log.append(stat)
-        output_log.insert(1,cluster.name)
-        output_log.append(used_proxy)
-        self.__log.write("{0}\t{1}: | CPU: {2}% | RAM: {3}% | Storage: {4}% {5}".format(*output_log))
+                severity = Severity.WARN
+                high.append(name)
+            stats.append(stat)
+        message = "{0}: | CPU: {1}% | RAM: {2}% | Storage: {3}% {4}".format(cluster.name, *stats, f"[route: {route}]" if route else "")
+        if high:
+            message += " {} failed QS inspection".format(", ".join(high))
+        self.__log.event(severity, cluster.name, "prometheusUsage", message)
+
+    def __loadPrometheusPage(self, cluster: Cluster, path: str, name: str, proxy:bool=False) -> None:
+        '''
+        Checks a Prometheus page via the standard route and optionally the Rancher proxy.
+        The standard route is skipped while the route cache knows it to be failing.
+
+        Params
+        ------
+        cluster : Cluster
+            the cluster to scrape from
+        path : str
+            the Prometheus page
+        name : str
+            the name of the check
+        proxy : bool, default: False
+            check the Rancher proxy too
+        '''
+        check = name[0].lower() + name[1:]
+        if self.__routes.get(cluster.id) == "proxy":
+            self.__log.event(Severity.FAILED, cluster.name, check, f"{cluster.name} : {name} returned HTTP | ingress unavailable [route: proxy]")
+        else:
+            severity, status = self.get_RAW(self.__prometheusURL(cluster, "standard", path), auth=False)
+            self.__log.event(severity, cluster.name, check, f"{cluster.name} : {name} returned HTTP | {status}")
+        if proxy or self.__routes.get(cluster.id) == "proxy":
+            severity, status = self.get_RAW(self.__prometheusURL(cluster, "proxy", path))
+            self.__log.event(severity, cluster.name, f"{check}Proxy", f"{cluster.name} : {name}_proxy returned HTTP | {status}")
 
     def __loadPrometheusTargets(self, cluster: Cluster, proxy:bool=False) -> None:
         '''
@@ -110,16 +242,7 @@ class Dashboard():
         clusterName : str
             the clusters name
         '''
-        __path = "targets"
-        url = f"{cluster.base}/monitoring/prometheus/{__path}"
-        output_log = self.get_RAW(url, auth=False)
-        output_log.insert(1,cluster.name)
-        self.__log.write("{0}\t{1} : PrometheusTargets returned HTTP | {2}".format(*output_log))
-        if proxy:
-            url = f"{self.__url}/k8s/clusters/{cluster.id}/api/v1/namespaces/cattle-monitoring-system/services/http:rancher-monitoring-prometheus:9090/proxy/{__path}"
-            output_log = self.get_RAW(url)
-            output_log.insert(1,cluster.name)
-            self.__log.write("{0}\t{1} : PrometheusTargets_proxy returned HTTP | {2}".format(*output_log))
+        self.__loadPrometheusPage(cluster, "targets", "PrometheusTargets", proxy)
         
     def __loadPrometheusGraph(self, cluster:Cluster, proxy:bool=False) -> None:
         '''
@@ -132,16 +255,7 @@ class Dashboard():
         clusterName : str
             the clusters name
         '''
-        __path = "graph"
-        url = f"{cluster.base}/monitoring/prometheus/{__path}"
-        output_log = self.get_RAW(url, auth=False)
-        output_log.insert(1,cluster.name)
-        self.__log.write("{0}\t{1} : PrometheusGraph returned HTTP | {2}".format(*output_log))
-        if proxy:
-            url = f"{self.__url}/k8s/clusters/{cluster.id}/api/v1/namespaces/cattle-monitoring-system/services/http:rancher-monitoring-prometheus:9090/proxy/{__path}"
-            output_log = self.get_RAW(url)
-            output_log.insert(1,cluster.name)
-            self.__log.write("{0}\t{1} : PrometheusGraph_proxy returned HTTP | {2}".format(*output_log))
+        self.__loadPrometheusPage(cluster, "graph", "PrometheusGraph", proxy)
 
     def __loadJaeger(self, cluster:Cluster) -> None:
         '''
@@ -155,9 +269,8 @@ class Dashboard():
             the clusters name
         '''
         url = f"{self.__url}/k8s/clusters/{cluster.id}/api/v1/namespaces/istio-system/services/http:tracing:16686/proxy/jaeger/search"
-        output_log = self.get_RAW(url)
-        output_log.insert(1,cluster.name)
-        self.__log.write("{0}\t{1} : Jaeger returned HTTP | {2}".format(*output_log))
+        severity, status = self.get_RAW(url)
+        self.__log.event(severity, cluster.name, "jaeger", f"{cluster.name} : Jaeger returned HTTP | {status}")
 
     def load(self, cluster: Cluster, dashboardType: str) -> None:
         '''
@@ -186,6 +299,22 @@ class Dashboard():
         else:
             raise NotImplementedError()
 
+    def runClusterQS(self, cluster:Cluster) -> None:
+        '''
+        Runs all Dashboard checks for a single cluster
+
+        Params
+        ------
+        cluster : Cluster
+            the cluster to scrape data from
+        '''
+        if cluster.state == "active":
+            for dashboardType, check in [("grafana", "prometheusUsage"), ("promTargets", "promTargets"), ("promGraphs", "promGraphs")]:
+                runCheck("dashboard", self.__cadence, self.__log, cluster, check, lambda: self.load(cluster, dashboardType=dashboardType))
+            # self.load(cluster, dashboardType="jaeger") # jaeger might not be installed...
+        else:
+            self.__log.print("Cluster {} has failed active state...".format(cluster.name))
+
     def runQS(self, clusters:list[Cluster]) -> None:
         '''
         Main Run function for QS. Does this for each cluster specified. Writes the output data to the QSLog
@@ -196,11 +325,5 @@ class Dashboard():
             the clusters to scrape data from
         '''
         for cluster in clusters:
-            print("--------\n[ \033[1;35mChecking\033[0m ] {}".format(cluster.name))
-            if cluster.state == "active":
-                self.load(cluster, dashboardType="grafana")
-                self.load(cluster, dashboardType="promTargets")
-                self.load(cluster, dashboardType="promGraphs")
-                # self.load(cluster, dashboardType="jaeger") # jaeger might not be installed...
-            else:
-                print("Cluster {} has failed active state...".format(cluster.name))
+            self.__log.checking(cluster.name)
+            self.runClusterQS(cluster)
@@ -1,37 +1,117 @@
 #!/bin/python
 
-import re
 import time
+import threading
+from contextlib import contextmanager
+from enum import Enum
+from typing import List
+
+
+class Severity(Enum):
+    OK = "ok"
+    WARN = "warn"
+    FAILED = "failed"
+    INFO = "info"
+
+
+# console prefix for each severity
+COLORS = {
+    Severity.OK: "[ \033[0;32mOK\033[0m ]\t\t",
+    Severity.WARN: "[ \033[1;33mWARN\033[0m ]\t",
+    Severity.FAILED: "[\033[0;31mFailed\033[0m]\t",
+    Severity.INFO: "[ \033[0;34mINFO\033[0m ]\t"
+}
+CHECKING = "--------\n[ \033[1;35mChecking\033[0m ] {}"
+
+
+class Event():
+    '''A QS result
+
+    Attributes
+    ----------
+    severity : Severity
+        the result of the check
+    cluster : str
+        the cluster name
+    check : str
+        the name of the check
+    message : str
+        the description
+    duration : float, default: None
+        seconds the check took until the result
+    timestamp : float
+        time of the result
+    '''
+    __slots__ = ("severity", "cluster", "check", "message", "duration", "timestamp")
+
+    def __init__(self, severity: Severity, cluster: str, check: str, message: str, duration: float=None) -> None:
+        self.severity = severity
+        self.cluster = cluster
+        self.check = check
+        self.message = message
+        self.duration = duration
+        self.timestamp = time.time()
+
+    def __str__(self) -> str:
+        return self.message
+
+    def render(self) -> str:
+        '''
+        Console representation with colored severity
+        '''
+        return f"{COLORS[self.severity]}{self.message}"
+
+    def asdict(self) -> dict:
+        return {
+            "severity": self.severity.value,
+            "cluster": self.cluster,
+            "check": self.check,
+            "message": self.message,
+            "duration": self.duration,
+            "timestamp": self.timestamp
+        }
+
 
 class QSLog():
     '''The QS Logging Mechanism
 
     Logs data and writes them to console. Returning API data for REST API Calls.
+    Writing is thread safe. Console output of a cluster can be grouped with `group`.
     
     '''
     
     def __init__(self) -> None:
-        self.__fail_log = []
-        self.__warn_log = []
-        self.__success_log = []
-        self.__info_log = []
+        self.__events = {severity: [] for severity in Severity}
         self.__lastRun = 0
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        # (cluster, result check) -> the check recording the result
+        self.__sources = {}
+        # (cluster, check) of the checks that were not due
+        self.__notDue = set()
 
     @property
-    def fails(self):
-        return self.__fail_log
+    def fails(self) -> List[str]:
+        return [e.message for e in self.__events[Severity.FAILED]]
 
     @property
-    def warn(self):
-        return self.__warn_log
+    def warn(self) -> List[str]:
+        return [e.message for e in self.__events[Severity.WARN]]
     
     @property
-    def success(self):
-        return self.__success_log
+    def success(self) -> List[str]:
+        return [e.message for e in self.__events[Severity.OK]]
     
     @property
-    def info(self):
-        return self.__info_log
+    def info(self) -> List[str]:
+        return [e.message for e in self.__events[Severity.INFO]]
+
+    @property
+    def events(self) -> List[Event]:
+        '''
+        All results without infos
+        '''
+        return self.__events[Severity.FAILED] + self.__events[Severity.WARN] + self.__events[Severity.OK]
 
     @property
     def lastRun(self):
@@ -39,37 +119,128 @@ class QSLog():
 
     @property
     def total(self):
-        return len(self.__fail_log) + len(self.__warn_log) + len(self.__success_log)
+        return len(self.__events[Severity.FAILED]) + len(self.__events[Severity.WARN]) + len(self.__events[Severity.OK])
     
-    def write(self, log:str):
+    @contextmanager
+    def group(self, name:str):
         '''
-        Write the result to Console and store the information in a list separating by type
+        Buffer the console output of the current thread and print it as one block
 
         Params
         ------
-        log : str
-            the log to write. Color encoded...
-        
-        Raises
+        name : str
+            the name of the group, e.g. the cluster name
+        '''
+        buffer = [CHECKING.format(name)]
+        self.__local.buffer = buffer
+        try:
+            yield self
+        finally:
+            self.__local.buffer = None
+            with self.__lock:
+                print("\n".join(buffer))
+
+    @contextmanager
+    def running(self, check:str):
+        '''
+        Times a check. Results the current thread records meanwhile get the seconds since its start as duration
+
+        Params
         ------
-        NotImplementedError
-            The Log Format does not exist. Must be in OK, Warn, Failed...
-        '''
-        print(log)
-        log = log.split("\t")
-        description = re.search(r'[^m]m(.*?)\x1b', log[0]).groups()[0].lower()
-        event = log[-1]
-        if description == "failed":
-            self.__fail_log.append(event)
-        elif description == "warn":
-            self.__warn_log.append(event)
-        elif description ==  "ok":
-            self.__success_log.append(event)
-        elif description == "info":
-            self.__info_log.append(event)
+        check : str
+            the name of the check
+        '''
+        self.__local.start = time.perf_counter()
+        self.__local.check = check
+        try:
+            yield self
+        finally:
+            self.__local.start = None
+            self.__local.check = None
+
+    def notDue(self, cluster:str, check:str) -> None:
+        '''
+        Marks a check that did not run on a cluster, because it was not due. `carry` takes over its results
+        '''
+        with self.__lock:
+            self.__notDue.add((cluster, check))
+
+    def checking(self, name:str):
+        '''
+        Print the header of a cluster to console
+        '''
+        self.print(CHECKING.format(name))
+
+    def print(self, *args):
+        '''
+        Print to console. Respects the output grouping of the current thread.
+        '''
+        line = " ".join(str(arg) for arg in args)
+        buffer = getattr(self.__local, "buffer", None)
+        if buffer is None:
+            print(line)
         else:
-            raise NotImplementedError("{} not a valid identifier".format(description))
+            buffer.append(line)
+
+    def event(self, severity: Severity, cluster: str, check: str, message: str, duration: float=None) -> Event:
+        '''
+        Record a result and write it to Console
+
+        Params
+        ------
+        severity : Severity
+            the result of the check
+        cluster : str
+            the cluster name
+        check : str
+            the name of the check
+        message : str
+            the description
+        duration : float, default: None
+            seconds the check took. Defaults to the time since the start of the running check
+
+        Returns
+        -------
+        Event
+            the recorded result
+        '''
+        start = getattr(self.__local, "start", None)
+        if duration is None and start is not None:
+            duration = time.perf_counter() - start
+        event = Event(severity, cluster, check, message, duration)
+        self.print(event.render())
+        running = getattr(self.__local, "check", None)
+        with self.__lock:
+            self.__events[severity].append(event)
+            if running is not None:
+                self.__sources[(cluster, check)] = running
+        return event
     
+    def carry(self, previous: "QSLog") -> int:
+        '''
+        Takes over the latest results of the checks that were not due in this run
+
+        Params
+        ------
+        previous : QSLog
+            the log of the previous run
+
+        Returns
+        -------
+        int
+            number of results taken over
+        '''
+        carried = 0
+        with self.__lock:
+            for severity, events in previous.__events.items():
+                for event in events:
+                    source = previous.__sources.get((event.cluster, event.check))
+                    if (event.cluster, source) in self.__notDue:
+                        self.__events[severity].append(event)
+                        self.__sources[(event.cluster, event.check)] = source
+                        carried += 1
+        return carried
+
     def summarize(self):
         '''
         Pretty Print the Faillog to Console
@@ -79,9 +250,9 @@ class QSLog():
         print("\n{}".format("".join(["*" for i in range(28)])))
         print("\nSummary")
         print("\n{}".format("".join(["-" for i in range(28)])))
-        print(f"tests failed\t\t|{len(self.__fail_log):3}")
-        print(f"tests warned\t\t|{len(self.__warn_log):3}")
-        print(f"tests succeeded\t\t|{len(self.__success_log):3}")
+        print(f"tests failed\t\t|{len(self.__events[Severity.FAILED]):3}")
+        print(f"tests warned\t\t|{len(self.__events[Severity.WARN]):3}")
+        print(f"tests succeeded\t\t|{len(self.__events[Severity.OK]):3}")
         print("{}".format("".join(["-" for i in range(28)])))
         print(f"total tests\t\t|{self.total:3}")
         print(f"\nTests ran {time.strftime('%a, %d.%m.%y %H:%M:%S')}")
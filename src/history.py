@@ -0,0 +1,161 @@
+#!/bin/python
+
+from array import array
+from collections import deque
+from typing import List, Optional, Tuple
+import threading
+from faillog import QSLog, Severity
+
+
+# outcome of a check in a run. Higher is worse, so the worst result of a check wins
+OUTCOMES = (None, Severity.OK, Severity.WARN, Severity.FAILED)
+CODES = {severity: code for code, severity in enumerate(OUTCOMES) if severity is not None}
+
+
+class RunSummary():
+    '''Compact summary of one QS run
+
+    Attributes
+    ----------
+    timestamp : float
+        time the run finished
+    duration : float
+        seconds the run took
+    fails, warnings, success : int
+        number of results per severity
+    outcomes : array
+        one byte per (cluster, check) key of the history, 0 if the check did not run
+    '''
+    __slots__ = ("timestamp", "duration", "fails", "warnings", "success", "outcomes")
+
+    def __init__(self, timestamp: float, duration: float, fails: int, warnings: int, success: int, outcomes: array) -> None:
+        self.timestamp = timestamp
+        self.duration = duration
+        self.fails = fails
+        self.warnings = warnings
+        self.success = success
+        self.outcomes = outcomes
+
+
+class RunHistory():
+    '''Bounded History of QS runs
+
+    Ring buffer of the last `size` runs. The (cluster, check) keys are interned once and each run only keeps one byte
+    per key, so the memory is fixed by the number of runs and checks instead of the messages. Keys without an outcome
+    in the kept runs, e.g. of removed clusters, are dropped once they are half of all keys.
+
+    Attributes
+    ----------
+    size : int, default: 1440
+        number of runs kept. 1440 runs are one day with a run every minute
+    '''
+
+    def __init__(self, size: int=1440) -> None:
+        self.__runs = deque(maxlen=size)
+        self.__keys = {}
+        self.__names: List[Tuple[str, str]] = []
+        # number of the last run with an outcome per key
+        self.__seen: List[int] = []
+        self.__count = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self.__runs.maxlen
+
+    def __getstate__(self) -> dict:
+        with self.__lock:
+            return {"runs": list(self.__runs), "size": self.size, "names": list(self.__names), "seen": list(self.__seen), "count": self.__count}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__runs = deque(state["runs"], maxlen=state["size"])
+        self.__names = state["names"]
+        self.__keys = {name: index for index, name in enumerate(self.__names)}
+        self.__seen = state["seen"]
+        self.__count = state["count"]
+        self.__lock = threading.Lock()
+
+    def __index(self, cluster: str, check: str) -> int:
+        key = (cluster, check)
+        index = self.__keys.get(key)
+        if index is None:
+            index = self.__keys[key] = len(self.__names)
+            self.__names.append(key)
+            self.__seen.append(0)
+        return index
+
+    def __prune(self) -> None:
+        '''
+        Drops the keys without an outcome in the kept runs once they are half of all keys. The runs are copied, so
+        running queries keep their indexes
+        '''
+        oldest = self.__count - len(self.__runs) + 1
+        alive = [index for index, seen in enumerate(self.__seen) if seen >= oldest]
+        if (len(self.__names) - len(alive)) * 2 <= len(self.__names):
+            return
+        self.__runs = deque((RunSummary(run.timestamp, run.duration, run.fails, run.warnings, run.success,
+                                        array('B', (run.outcomes[index] if index < len(run.outcomes) else 0 for index in alive)))
+                             for run in self.__runs), maxlen=self.__runs.maxlen)
+        self.__names = [self.__names[index] for index in alive]
+        self.__seen = [self.__seen[index] for index in alive]
+        self.__keys = {name: index for index, name in enumerate(self.__names)}
+
+    def record(self, log: QSLog, duration: float) -> RunSummary:
+        '''
+        Adds the results of a finished run
+
+        Params
+        ------
+        log : QSLog
+            the log of the run
+        duration : float
+            seconds the run took
+        '''
+        with self.__lock:
+            events = log.events
+            self.__count += 1
+            for event in events:
+                self.__seen[self.__index(event.cluster, event.check)] = self.__count
+            outcomes = array('B', bytes(len(self.__names)))
+            for event in events:
+                index = self.__keys[(event.cluster, event.check)]
+                outcomes[index] = max(outcomes[index], CODES[event.severity])
+            run = RunSummary(log.lastRun, duration, len(log.fails), len(log.warn), len(log.success), outcomes)
+            self.__runs.append(run)
+            self.__prune()
+        return run
+
+    def query(self, cluster: Optional[str]=None, check: Optional[str]=None, last: Optional[int]=None) -> List[dict]:
+        '''
+        Returns the runs, oldest first
+
+        Params
+        ------
+        cluster : str, default: None
+            only outcomes of this cluster
+        check : str, default: None
+            only outcomes of this check
+        last : int, default: None
+            only the last n runs
+        '''
+        with self.__lock:
+            runs = list(self.__runs)
+            keys = [(index, name) for index, name in enumerate(self.__names)
+                    if (cluster is None or name[0] == cluster) and (check is None or name[1] == check)]
+        if last is not None:
+            runs = runs[-last:] if last > 0 else []
+        result = []
+        for run in runs:
+            checks = [{"cluster": name[0], "check": name[1], "severity": OUTCOMES[run.outcomes[index]].value}
+                      for index, name in keys if index < len(run.outcomes) and run.outcomes[index]]
+            result.append({
+                "lastRun": run.timestamp,
+                "duration": run.duration,
+                "absolute": {
+                    "fails": run.fails,
+                    "warnings": run.warnings,
+                    "success": run.success
+                },
+                "checks": checks
+            })
+        return result
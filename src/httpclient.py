@@ -0,0 +1,290 @@
+#!/bin/python
+
+from typing import Any, Dict, Tuple
+import threading
+import time
+from requests import Session, Response
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException, Timeout
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from prometheus_client import Counter, Gauge
+from cache import ResponseCache, c_cache, c_cache_saved
+from metrics import endpoint, observeRequest
+
+
+c_connections = Counter("opserver_http_connections", "HTTP connections opened or reused by a request", ['state'])
+c_skipped = Counter("opserver_http_skipped", "HTTP requests not sent because of an open circuit or an exhausted cluster budget", ['reason'])
+g_circuits = Gauge("opserver_http_circuits_open", "Endpoints with an open circuit breaker")
+
+# the budget of the cluster the current thread checks
+_local = threading.local()
+
+
+class Skipped(RequestException):
+    '''A request that was not sent'''
+
+
+class CircuitOpen(Skipped):
+    '''The endpoint failed repeatedly and is skipped until its next probe'''
+
+
+class BudgetExhausted(Skipped):
+    '''The time budget of the cluster in this cycle is used up'''
+
+
+class Budget():
+    '''Time Budget of a Cluster per Cycle
+
+    Charges the time the checks of the cluster run while the budget is entered with `with`. Requests sent on the thread
+    meanwhile time out when the budget runs out, and are not sent once it is used up.
+
+    Attributes
+    ----------
+    name : str, default: ""
+        the cluster name
+    seconds : float, default: 0
+        seconds all checks of the cluster may take per cycle. 0 is unlimited
+    '''
+
+    def __init__(self, name: str="", seconds: float=0) -> None:
+        self.name = name
+        self.seconds = seconds
+        self.__spent = 0.0
+        self.__since = None
+        self.__depth = 0
+
+    @property
+    def remaining(self) -> float:
+        '''seconds left. Infinite without a limit'''
+        if not self.seconds:
+            return float("inf")
+        running = time.monotonic() - self.__since if self.__since is not None else 0
+        return self.seconds - self.__spent - running
+
+    def __enter__(self) -> "Budget":
+        self.__depth += 1
+        if self.__depth == 1:
+            self.__since = time.monotonic()
+            _local.budget = self
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.__depth -= 1
+        if self.__depth == 0:
+            self.__spent += time.monotonic() - self.__since
+            self.__since = None
+            _local.budget = None
+
+
+class CircuitBreaker():
+    '''Circuit Breaker per Endpoint
+
+    An endpoint is a path template on a cluster, see `metrics.endpoint`. After `threshold` failed requests in a row the
+    circuit of the endpoint opens and its requests are skipped. Once the backoff passed, one request probes the
+    endpoint. A successful probe closes the circuit, a failed one opens it again with the doubled backoff.
+    Only connection errors and timeouts count as failures. HTTP error responses are results of the checks, timeouts
+    shortened by the budget of the cluster are budget outcomes.
+
+    Attributes
+    ----------
+    threshold : int, default: 3
+        failures in a row opening the circuit. 0 disables the breaker
+    backoff : float, default: 60
+        seconds until the first probe
+    maxBackoff : float, default: 900
+        upper bound of the backoff
+    '''
+
+    def __init__(self, threshold: int=3, backoff: float=60, maxBackoff: float=900) -> None:
+        self.__threshold = threshold
+        self.__backoff = backoff
+        self.__maxBackoff = maxBackoff
+        # endpoint -> [failures in a row, current backoff, time of the next probe or None if closed]
+        self.__circuits: Dict[Tuple[str, str], list] = {}
+        self.__lock = threading.Lock()
+
+    def allow(self, key: Tuple[str, str]) -> None:
+        '''
+        Raises CircuitOpen if the circuit of the endpoint is open and not due for a probe
+        '''
+        if not self.__threshold:
+            return
+        with self.__lock:
+            circuit = self.__circuits.get(key)
+            if circuit is None or circuit[2] is None:
+                return
+            now = time.monotonic()
+            if now < circuit[2]:
+                raise CircuitOpen(f"circuit open for {key[0]}{key[1]} after {circuit[0]} failures, next probe in {circuit[2] - now:.0f}s")
+            # this request probes the endpoint. Concurrent requests wait for its result
+            circuit[2] = now + circuit[1]
+
+    def success(self, key: Tuple[str, str]) -> None:
+        if not self.__threshold:
+            return
+        with self.__lock:
+            circuit = self.__circuits.pop(key, None)
+            if circuit is not None and circuit[2] is not None:
+                g_circuits.dec()
+
+    def failure(self, key: Tuple[str, str]) -> None:
+        if not self.__threshold:
+            return
+        with self.__lock:
+            circuit = self.__circuits.setdefault(key, [0, self.__backoff, None])
+            circuit[0] += 1
+            if circuit[2] is not None:
+                # the probe failed
+                circuit[1] = min(circuit[1] * 2, self.__maxBackoff)
+            elif circuit[0] >= self.__threshold:
+                g_circuits.inc()
+            else:
+                return
+            circuit[2] = time.monotonic() + circuit[1]
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    '''Connection Pool counting the requests sent on new and reused connections'''
+
+    def _make_request(self, conn, *args, **kwargs):
+        # the socket of a new or dropped connection is None -> a new TCP/TLS handshake follows
+        c_connections.labels("reused" if getattr(conn, "sock", None) is not None else "opened").inc()
+        return super()._make_request(conn, *args, **kwargs)
+
+
+class CountingHTTPSConnectionPool(CountingHTTPConnectionPool, HTTPSConnectionPool):
+    pass
+
+
+class PoolAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool
+        }
+
+
+class HTTPClient():
+    '''Shared HTTP Client
+
+    Keep-Alive connection pools per host shared by all QS steps.
+
+    Attributes
+    ----------
+    token : str
+        Bearer-Token for Authentification
+    verify : bool, default: True
+        verify SSL certificate
+    n_clusters : int, default: 1
+        number of clusters. Sizes the number of host pools
+    concurrency : int, default: 1
+        number of parallel workers. Sizes the connections per host
+    cache : ResponseCache, default: None
+        cache for requests sent with `cache=True`
+    timeout : float, default: 10
+        seconds to connect and to wait for each read of a response
+    breaker : CircuitBreaker, default: None
+        skips failing endpoints. None disables it
+    '''
+
+    def __init__(self, token: str, verify: bool=True, n_clusters: int=1, concurrency: int=1, cache: ResponseCache=None, timeout: float=10, breaker: CircuitBreaker=None) -> None:
+        self.__auth = {"Authorization": "Bearer {}".format(token)}
+        self.__cache = cache
+        self.__timeout = timeout
+        self.__breaker = breaker
+        self.__session = Session()
+        self.__session.verify = verify
+        # one pool for rancher and one for each cluster ingress
+        adapter = PoolAdapter(pool_connections=n_clusters+1, pool_maxsize=max(concurrency, 1))
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+
+    @property
+    def stats(self) -> dict:
+        '''
+        Number of requests sent on newly opened and on reused connections
+        '''
+        samples = c_connections.collect()[0].samples
+        stats = {"opened": 0, "reused": 0}
+        stats.update({s.labels["state"]: int(s.value) for s in samples if s.name.endswith("_total")})
+        return stats
+
+    def __send(self, url: str, params: dict, headers: dict, **kwargs: Any) -> Response:
+        timeout = full = kwargs.pop("timeout", self.__timeout)
+        budget = getattr(_local, "budget", None)
+        if budget is not None:
+            remaining = budget.remaining
+            if remaining <= 0:
+                c_skipped.labels("budget").inc()
+                raise BudgetExhausted(f"time budget of {budget.seconds:g}s for cluster {budget.name} exhausted")
+            timeout = min(timeout, remaining)
+        key = endpoint(url) if self.__breaker is not None else None
+        if key is not None:
+            try:
+                self.__breaker.allow(key)
+            except CircuitOpen:
+                c_skipped.labels("circuit").inc()
+                raise
+        start = time.perf_counter()
+        try:
+            response = self.__session.get(url, params=params, headers=headers, timeout=timeout, **kwargs)
+        except Exception as e:
+            observeRequest(url, "error", time.perf_counter() - start, 0)
+            if isinstance(e, Timeout) and timeout < full:
+                # the budget cut the timeout short. That says nothing about the endpoint
+                c_skipped.labels("budget").inc()
+                raise BudgetExhausted(f"time budget of {budget.seconds:g}s for cluster {budget.name} exhausted after {timeout:.2f}s of the request") from e
+            if key is not None:
+                self.__breaker.failure(key)
+            raise
+        if key is not None:
+            self.__breaker.success(key)
+        # streamed bodies are not read yet
+        size = int(response.headers.get("Content-Length", 0)) if kwargs.get("stream") else len(response.content)
+        observeRequest(url, str(response.status_code), time.perf_counter() - start, size)
+        return response
+
+    def get(self, url: str, params: dict=None, auth: bool=True, cache: bool=False, ttl: bool=False, **kwargs: Any) -> Response:
+        '''
+        Sends a GET request using the pooled connections. Within a `Budget` the timeout is capped by the remaining budget
+
+        Params
+        ------
+        url : str
+            the url to request
+        params : dict, default: None
+            query parameters
+        auth : bool, default: True
+            send the Rancher Bearer-Token
+        cache : bool, default: False
+            answer from and store into the response cache
+        ttl : bool, default: False
+            serve the cached response for the TTL of the cache, even if the server sends no ETag or Last-Modified.
+            For lists that rarely change
+
+        Raises
+        ------
+        Skipped
+            the circuit of the endpoint is open or the budget of the cluster is exhausted
+        '''
+        headers = dict(self.__auth) if auth else {}
+        if not cache or self.__cache is None:
+            return self.__send(url, params, headers, **kwargs)
+        key = f"{url}|{sorted(params.items()) if params else ''}"
+        entry = self.__cache.get(key)
+        if entry is not None:
+            if self.__cache.fresh(entry):
+                c_cache.labels("hit").inc()
+                c_cache_saved.inc(len(entry.content))
+                return entry.response(url)
+            headers.update(self.__cache.validators(entry))
+        response = self.__send(url, params, headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            c_cache.labels("revalidated").inc()
+            c_cache_saved.inc(len(entry.content))
+            self.__cache.refresh(entry)
+            return entry.response(url)
+        if response.status_code == 200 and self.__cache.put(key, response, ttl=ttl):
+            c_cache.labels("miss").inc()
+        return response
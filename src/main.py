@@ -6,24 +6,52 @@ import warnings
 from codetiming import Timer
 from typing import List
 from dataclasses import asdict
-from requests import get
+from concurrent.futures import ThreadPoolExecutor
 from requests.exceptions import ConnectTimeout
 from clusters import K8sCluster, Cluster, ClusterConfig
 from manager import Manager, ResourceLimits
+from analyze import AnalysisPool, LogWatermarks, TemplateIndex, LogSave
+from history import RunHistory
+from store import ResultStore
 from faillog import QSLog
 from monitoring import Monitor
-from explorer import Dashboard
-from security import secure_headers
+from explorer import Dashboard, PrometheusRoutes
+from security import securityHeaders
+from snapshot import Snapshot, Representation
+from shared import SharedState
+from scheduler import Scheduler
+from cadence import Cadence
+import metrics
+from debug import CycleProfiler
+from sharding import ShardAggregator, assign
+from httpclient import HTTPClient, CircuitBreaker
+from cache import ResponseCache
+import atexit
+import functools
+import hmac
+import signal
+import sys
 import yaml
 import os
+import sqlite3
 import time
-from flask import Flask, render_template
+from flask import Flask, Response, render_template, request
 import threading
-from prometheus_client import make_wsgi_app, Gauge, Counter, Histogram
+from multiprocessing import get_context
+from prometheus_client import make_wsgi_app, generate_latest, Gauge, Counter, Histogram, CONTENT_TYPE_LATEST
+from waitress import create_server
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 
 
-updateLog:QSLog
+updateLog:QSLog = None
+snapshot:Snapshot = None
+history = RunHistory()
+store: ResultStore = None
+shared: SharedState = None
+server = None
+profiler: CycleProfiler = None
+debugToken: str = None
+aggregator: ShardAggregator = None
 app = Flask(__name__, static_url_path='/static')
 g_tests = Gauge("opserver_observed_test", "observed test metrics", ['type'])
 g_total_tests = Gauge("opserver_total_tests", "total number of tests to perform")
@@ -36,20 +64,40 @@ if os.getenv("APPLICATION_ROOT"):
     app.config['APPLICATION_ROOT'] = os.getenv("APPLICATION_ROOT")
 
 class QS():
-    def __init__(self, clusters: List[Cluster], config:ClusterConfig, limits: ResourceLimits) -> None:
+    def __init__(self, clusters: List[Cluster], config:ClusterConfig, limits: ResourceLimits, client: HTTPClient, routes: PrometheusRoutes, watermarks: LogWatermarks, templates: TemplateIndex, history: RunHistory, store: ResultStore=None, upload: LogSave=None, shared: SharedState=None, cadence: Cadence=None, profiler: CycleProfiler=None, analysis: AnalysisPool=None) -> None:
         self.__clusters = clusters
-        self.__token = config.apiToken
+        self.__client = client
+        self.__routes = routes
+        self.__watermarks = watermarks
+        self.__templates = templates
+        self.__history = history
+        self.__store = store
+        self.__upload = upload
+        self.__shared = shared
+        self.__cadence = cadence
+        self.__profiler = profiler if profiler is not None else CycleProfiler()
+        self.__analysis = analysis
+        self.__logWindow = config.logWindow
+        self.__stopWords = config.stopWords
         self.__url = config.clusterURL
         self.__limits = limits
         self.__debug = config.debug
         self.__proxy = config.proxy
-        self.__verify = config.verify
+        self.__daemonSets = config.daemonsets
+        self.__concurrency = config.concurrency
         self.__log = QSLog()
 
     @Timer(name="Complete Run")
     @h_duration.time()
     def run(self, step=None):
-        if step==None:
+        with self.__profiler.cycle():
+            self.__run(step)
+
+    def __run(self, step=None):
+        start = time.perf_counter()
+        if self.__concurrency > 1:
+            self.__parallel(step)
+        elif step==None:
             self.__managing()
             self.__dashboard()
             self.__monitoring()
@@ -62,9 +110,26 @@ class QS():
                 self.__monitoring()
             else:
                 raise NotImplementedError()
-        self.__log.summarize()
+        fresh = self.__log.events
         global updateLog
+        if updateLog is not None and self.__cadence is not None:
+            carried = self.__log.carry(updateLog)
+            print(f"Results of checks not due in this run: {carried}")
+        self.__log.summarize()
+        print("HTTP requests on opened connections: {opened} | on reused connections: {reused}".format(**self.__client.stats))
         updateLog = self.__log
+        published = publish()
+        self.__history.record(self.__log, time.perf_counter()-start)
+        if self.__shared is not None:
+            self.__shared.publish({"snapshot": published, "history": self.__history, "metrics": generate_latest()})
+        if self.__store is not None:
+            try:
+                self.__store.write(fresh)
+            except sqlite3.Error as e:
+                print(f"Storing the results failed: {e}")
+        if self.__upload is not None:
+            for event in fresh:
+                self.__upload.write(event.asdict())
         g_tests.labels("success").set(len(updateLog.success))
         g_tests.labels("warning").set(len(updateLog.warn))
         g_tests.labels("failed").set(len(updateLog.fails))
@@ -72,20 +137,47 @@ class QS():
         c_test.inc()
 
 
+    @Timer(name="QS parallel")
+    def __parallel(self, step=None):
+        '''
+        Checks the clusters in parallel. Each worker runs all steps for one cluster.
+        '''
+        runners = {
+            1: Manager(url=self.__url, client=self.__client, log=self.__log, limits=self.__limits, debug_=self.__debug, daemonSets=self.__daemonSets, watermarks=self.__watermarks, logWindow=self.__logWindow, stopWords=self.__stopWords, templates=self.__templates, cadence=self.__cadence, analysis=self.__analysis),
+            2: Dashboard(url=self.__url, client=self.__client, log=self.__log, routes=self.__routes, debug_=self.__debug, proxy=self.__proxy, cadence=self.__cadence),
+            3: Monitor(url=self.__url, client=self.__client, log=self.__log, debug_=self.__debug, cadence=self.__cadence)
+        }
+        if step == None:
+            runners = list(runners.values())
+        elif step in runners:
+            runners = [runners[step]]
+        else:
+            raise NotImplementedError()
+        print(f"--------\nRunning QS on {len(self.__clusters)} clusters with {self.__concurrency} workers...")
+
+        @self.__profiler.thread
+        def check(cluster: Cluster):
+            with self.__log.group(cluster.name):
+                for runner in runners:
+                    runner.runClusterQS(cluster)
+
+        with ThreadPoolExecutor(max_workers=self.__concurrency, thread_name_prefix="qs") as pool:
+            list(pool.map(check, self.__clusters))
+
     @Timer(name="QS from Dashboards")
     def __dashboard(self):
         print("--------\nSTEP 2 - Dashboard Cluster-Explorer\nrunning QS...")
-        Dashboard(url=self.__url, token=self.__token, log=self.__log, debug_=self.__debug, proxy=self.__proxy, verify=self.__verify).runQS(self.__clusters)  
+        Dashboard(url=self.__url, client=self.__client, log=self.__log, routes=self.__routes, debug_=self.__debug, proxy=self.__proxy, cadence=self.__cadence).runQS(self.__clusters)
 
     @Timer(name="QS from Cluster Management")
     def __managing(self):
         print("--------\nSTEP 1 - Rancher Cluster Manager\nrunning QS...")
-        Manager(url=self.__url, token=self.__token, log=self.__log, limits=self.__limits, debug_=self.__debug, verify=self.__verify).runQS(self.__clusters)
+        Manager(url=self.__url, client=self.__client, log=self.__log, limits=self.__limits, debug_=self.__debug, daemonSets=self.__daemonSets, watermarks=self.__watermarks, logWindow=self.__logWindow, stopWords=self.__stopWords, templates=self.__templates, cadence=self.__cadence, analysis=self.__analysis).runQS(self.__clusters)
 
     @Timer(name="QS from Monitoring")
     def __monitoring(self):
         print("--------\nSTEP 3 - Monitoring\nrunning QS...")
-        Monitor(url=self.__url, log=self.__log, debug_=self.__debug, verify=self.__verify).runQS(self.__clusters)
+        Monitor(url=self.__url, client=self.__client, log=self.__log, debug_=self.__debug, cadence=self.__cadence).runQS(self.__clusters)
 
 def argParser() -> Namespace:
     parser = ArgumentParser(description="Cluster Exploration und Dashboard Verifikation - QS")
@@ -117,11 +209,13 @@ def buildResponse():
             "fails": None,
             "warnings": None,
             "success": None,
-            "summarize": None
+            "summarize": None,
+            "results": None
         }
+    now = time.time()
     return {
             "cluster": os.getenv("CLUSTER_URL"),
-            "time": time.time(),
+            "time": now,
             "time_hr": time.strftime("%X %x"),
             "lastRun": updateLog.lastRun,
             "lastRun_hr": datetime.fromtimestamp(updateLog.lastRun).strftime("%X %x"),
@@ -149,7 +243,9 @@ def buildResponse():
                     "warnings": len(updateLog.warn),
                     "success": len(updateLog.success)
                 }
-            }
+            },
+            # latest result of each check with its age in seconds
+            "results": [dict(event.asdict(), age=round(now-event.timestamp, 1)) for event in updateLog.events]
         }
 
 def buildStatus():
@@ -178,44 +274,205 @@ def buildStatus():
         }
     return headers
 
+def renderSummary(response: dict, headers: dict) -> str:
+    try:
+        response["environment"] = response.get("cluster")
+        response["summarize"]["relative"] = {k:f"{round(v*100,2)}%" for k,v in response["summarize"]["relative"].items()}
+        return render_template("summarize.html", data=response)
+    except:
+        print("except:", headers.get("status_info"), 200, headers)
+        return headers.get("status_info")
+
+def buildSnapshot() -> Snapshot:
+    headers = buildStatus()
+    with app.app_context():
+        html = renderSummary(buildResponse(), headers)
+    return Snapshot(summary=buildResponse(), status=headers, html=html)
+
+def publish() -> Snapshot:
+    '''
+    Serialises the API state of the last run. Requests are answered from this snapshot until the next run.
+    Only called by the QS run
+    '''
+    global snapshot
+    snapshot = buildSnapshot()
+    return snapshot
+
+@functools.lru_cache(maxsize=1)
+def emptySnapshot() -> Snapshot:
+    '''
+    The snapshot answered until the first run is published. Built once and never published
+    '''
+    return buildSnapshot()
+
+def current() -> Snapshot:
+    '''
+    The snapshot to answer from. A separate API process reads it from the shared memory
+    '''
+    state = shared.read() if shared is not None else None
+    if state is not None:
+        return state["snapshot"]
+    return snapshot or emptySnapshot()
+
+def currentHistory() -> RunHistory:
+    state = shared.read() if shared is not None else None
+    return state["history"] if state is not None else history
+
+def sharedMetrics(environ, start_response):
+    '''
+    WSGI App serving the metrics of the last run published by the QS process
+    '''
+    state = shared.read()
+    start_response("200 OK", [("Content-Type", CONTENT_TYPE_LATEST)])
+    return [state["metrics"] if state is not None else b""]
+
+def serve(representation: Representation) -> Response:
+    body, status, headers = representation.response(
+        notModified=request.if_none_match.contains_weak(representation.etag),
+        acceptGzip=request.accept_encodings["gzip"] > 0
+    )
+    return Response(body, status=status, headers=headers)
+
 @app.after_request
 def set_security_headers(response):
-    secure_headers().framework.flask(response)
-    response.headers["X-Download-Options"] = "noopen"
+    cacheControl = response.headers.get("Cache-Control")
+    response.headers.update(securityHeaders())
+    if cacheControl is not None:
+        # snapshots are stored by the clients and revalidated with their ETag
+        response.headers["Cache-Control"] = cacheControl
     return response
 
 @app.route("/")
 @app.route("/summarize")
 def summarizeAsHTML():
-    headers = buildStatus()
-    try:
-        response = buildResponse()
-        response["environment"] = response.get("cluster")
-        response["summarize"]["relative"] = {k:f"{round(v*100,2)}%" for k,v in response["summarize"]["relative"].items()}
-        return render_template("summarize.html", data=response), 200, headers
-    except:
-        print("except:", headers.get("status_info"), 200, headers)
-        return headers.get("status_info"), 200, headers
+    return serve(current().html)
 
 @app.route("/v1/summarize")
 def summarizeAsJSON():
     # JSON response
-    return buildResponse()
+    return serve(current().json)
+
+@app.route("/v1/shards/summarize")
+def shardsAsJSON():
+    # the summaries of all shards merged into one
+    if aggregator is None:
+        return {"error": "no shard peers configured"}, 404
+    return aggregator.summarize()
+
+@app.route("/v1/history")
+def historyAsJSON():
+    history = currentHistory()
+    runs = history.query(
+        cluster=request.args.get("cluster"),
+        check=request.args.get("check"),
+        last=request.args.get("last", type=int)
+    )
+    return {"size": history.size, "count": len(runs), "runs": runs}
+
+@app.route("/v1/trend")
+def trendAsJSON():
+    if store is None:
+        return {"error": "no database configured"}, 404
+    if not request.args.get("cluster") or not request.args.get("check"):
+        return {"error": "cluster and check are required"}, 400
+    try:
+        return store.trend(
+            cluster=request.args["cluster"],
+            check=request.args["check"],
+            days=request.args.get("days", 30, type=int),
+            resolution=request.args.get("resolution", "day")
+        )
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+def debugRequest(kind: str):
+    '''
+    Instruments the next cycles. Only available with a configured debug token, sent as Bearer token
+    '''
+    if not debugToken or profiler is None:
+        return {"error": "not found"}, 404
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {debugToken}".encode()):
+        return {"error": "unauthorized"}, 401
+    try:
+        report = profiler.request(
+            kind,
+            cycles=request.args.get("cycles", 1, type=int),
+            top=request.args.get("top", 30, type=int),
+            sort=request.args.get("sort", "cumulative")
+        )
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except RuntimeError as e:
+        return {"error": str(e)}, 409
+    except TimeoutError as e:
+        return {"error": str(e)}, 504
+    return report, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.route("/debug/profile")
+def debugProfile():
+    return debugRequest("profile")
+
+@app.route("/debug/memory")
+def debugMemory():
+    return debugRequest("memory")
 
 @app.route("/status")
 def clusterStatus():
-    headers = buildStatus()
-    return headers.get("status_info"), 200, headers
+    return serve(current().status)
 
 
-def apiServer():
+def apiServer(threads: int=4, timeout: int=30, port: int=8080):
+    '''
+    Serves the API with a multi-threaded WSGI Server until it is stopped
+
+    Params
+    ------
+    threads : int, default: 4
+        number of threads answering requests
+    timeout : int, default: 30
+        seconds an idle or slow client connection is kept
+    port : int, default: 8080
+        the port to listen on
+    '''
+    global server
     app.config.update(
         SESSION_COOKIE_SECURE=True,
         SESSION_COOKIE_HTTPONLY=True,
         SESSION_COOKIE_SAMESITE='Lax',
         STATIC_ROOT=''
     )
-    app.run(host="0.0.0.0", port=8080, debug=False)
+    server = create_server(app, host="0.0.0.0", port=port, threads=threads, channel_timeout=timeout, ident="opserver")
+    server.run()
+
+def stopApiServer(timeout: float=5):
+    '''
+    Stops accepting connections and waits up to timeout seconds for running requests
+    '''
+    if server is not None:
+        server.task_dispatcher.shutdown(cancel_pending=False, timeout=timeout)
+        server.close()
+
+def apiProcess(name: str, threads: int, timeout: int, database: str=None, port: int=8080, peers: List[str]=None):
+    '''
+    Entrypoint of the separate API process. Answers from the state the QS process publishes to the shared memory `name`
+    '''
+    global shared, store, aggregator
+    shared = SharedState(name=name)
+    if database:
+        store = ResultStore(path=database)
+    if peers:
+        aggregator = ShardAggregator(peers)
+    app.wsgi_app.mounts["/metrics"] = sharedMetrics
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        apiServer(threads=threads, timeout=timeout, port=port)
+    finally:
+        stopApiServer()
+        shared.close()
+
+def stopApiProcess(process, timeout: float=10):
+    process.terminate()
+    process.join(timeout)
 
 if __name__=="__main__":
     args = argParser()
@@ -223,8 +480,33 @@ if __name__=="__main__":
     print("")
     print(f'config = {config}')
     print("")
+    if config.shardCount > 1:
+        config.clusters = assign(config.clusters, config.shardIndex, config.shardCount)
+        print(f"Shard {config.shardIndex} of {config.shardCount} checks {[c['name'] for c in config.clusters]}")
+    if config.shardPeers:
+        aggregator = ShardAggregator(config.shardPeers)
+    cache = ResponseCache(maxBytes=config.cacheSize*1024*1024, ttl=config.cacheTTL)
+    breaker = CircuitBreaker(threshold=config.breakerThreshold, backoff=config.breakerBackoff, maxBackoff=config.breakerMaxBackoff)
+    client = HTTPClient(token=config.apiToken, verify=config.verify, n_clusters=len(config.clusters), concurrency=config.concurrency, cache=cache, timeout=config.requestTimeout, breaker=breaker)
+    routes = PrometheusRoutes(ttl=config.routeTTL)
+    watermarks = LogWatermarks(sinceSeconds=config.logSince)
+    templates = TemplateIndex(similarity=config.templateSimilarity, maxTemplates=config.maxTemplates)
+    history = RunHistory(size=config.historySize)
+    cadence = Cadence(intervals=config.checkIntervals) if config.checkIntervals else None
+    metrics.configure(labelLimit=config.metricsLabelLimit)
+    profiler = CycleProfiler(interval=config.interval)
+    analysis = AnalysisPool(workers=config.analysisWorkers, queueSize=config.analysisQueue)
+    atexit.register(analysis.close)
+    # the API process can not instrument the cycles of the QS process
+    debugToken = None if config.apiProcess else config.debugToken
+    if config.database:
+        store = ResultStore(path=config.database, retention=config.databaseRetention)
+    upload = None
+    if config.bucket:
+        upload = LogSave(bucket=config.bucket, interval=config.uploadInterval, spillDir=config.spillDir, spillBytes=config.spillSize*1024*1024)
+        atexit.register(upload.close)
     try:
-        clusters = K8sCluster(config=config).loadClusters()
+        clusters = K8sCluster(config=config, client=client).loadClusters()
         print("")
         print(f'clusters = {clusters}')
         print("")
@@ -232,28 +514,40 @@ if __name__=="__main__":
         print(f"Connection to {config.clusterURL} failed. Host not reachable!")
         exit()
     #just wait till everything is up & running and start api-server
-    if not config.debug:
-        threading.Thread(target=apiServer, daemon=True).start()
-    else:
+    sharedState = None
+    if config.debug:
         print(clusters)
         print("Debugging Mode. Does not start the API Server")
         print([asdict(cluster) for cluster in clusters])
         warnings.simplefilter("ignore")
         warnings.catch_warnings()
-    lastTime = 0
-    while True:
-        # run every 1 minute... 
-        if time.time()-lastTime > 60:
-            lastTime = time.time()
-            print(f"\nStarting new Testcycle @ {time.strftime('%a, %d.%m.%y %H:%M:%S')}\n")
-            try:
-                clusters = K8sCluster(config=config).loadClusters()
-            except ConnectTimeout:
-                print(f"Connection to {config.clusterURL} failed. Host not reachable!")
-                exit()
-
-            print("CLUSTERS clusters:", clusters)
-            qs = QS(clusters=clusters, config=config, limits=ResourceLimits())
-            qs.run()
-        if config.debug:
-            break
\ No newline at end of file
+    elif config.apiProcess:
+        sharedState = SharedState(size=config.apiSharedMemory*1024*1024)
+        atexit.register(sharedState.close)
+        process = get_context("spawn").Process(target=apiProcess, name="api", daemon=True,
+            args=(sharedState.name, config.apiThreads, config.apiTimeout, config.database, config.apiPort, config.shardPeers))
+        process.start()
+        atexit.register(stopApiProcess, process)
+    else:
+        threading.Thread(target=apiServer, args=(config.apiThreads, config.apiTimeout, config.apiPort), daemon=True).start()
+        atexit.register(stopApiServer)
+    def cycle():
+        print(f"\nStarting new Testcycle @ {time.strftime('%a, %d.%m.%y %H:%M:%S')}\n")
+        try:
+            clusters = K8sCluster(config=config, client=client).loadClusters()
+        except ConnectTimeout:
+            print(f"Connection to {config.clusterURL} failed. Host not reachable!")
+            exit()
+
+        print("CLUSTERS clusters:", clusters)
+        qs = QS(clusters=clusters, config=config, limits=ResourceLimits(), client=client, routes=routes, watermarks=watermarks, templates=templates, history=history, store=store, upload=upload, shared=sharedState, cadence=cadence, profiler=profiler, analysis=analysis)
+        qs.run()
+
+    if config.debug:
+        cycle()
+    else:
+        scheduler = Scheduler(interval=config.interval, mode=config.schedule, jitter=config.jitter, overrun=config.overrun)
+        # finish the running cycle and exit, so the API server and the uploader shut down gracefully
+        signal.signal(signal.SIGTERM, scheduler.stop)
+        signal.signal(signal.SIGINT, scheduler.stop)
+        scheduler.run(cycle)
@@ -3,12 +3,13 @@ from dataclasses import dataclass
 import yaml
 import json
 import os
-from typing import Any, List
-from requests import get
+from typing import Any, Iterable, List
 import re
-from faillog import QSLog
-from analyze import IstioDAnalyze
+from faillog import QSLog, Severity
+from analyze import AnalysisPool, LogWatermarks, TemplateIndex
 from clusters import Cluster
+from httpclient import HTTPClient, Skipped
+from cadence import Cadence, runCheck
 
 
 @dataclass
@@ -22,6 +23,23 @@ class WorkloadSelector():
         if self.wtype not in ["pod", "service"]:
             raise ValueError(f"{self.wtype} not a valid Workloadtype. Allowed values are ['pod', 'service'].")
 
+    @property
+    def labelSelector(self) -> str:
+        return f"{self.key}={self.value}"
+
+# daemonsets to check with their expected replicas. "nodes" expects one per node
+DAEMONSETS = {
+    "rancher-monitoring-prometheus-node-exporter": "nodes",
+    "canal": "nodes",
+    "istio-cni-node": "nodes"
+}
+
+DAEMONSET_LABELS = {
+    "rancher-monitoring-prometheus-node-exporter": "Prometheus",
+    "canal": "Canal",
+    "istio-cni-node": "Istio CNI"
+}
+
 class ResourceLimits():
     def __init__(self):
         if os.path.exists("/config/limits.yaml"):
@@ -57,29 +75,50 @@ class Manager():
     ----------
     url: str
         the cluster rancher URL
-    token : str
-        Bearer Authentification token
+    client : HTTPClient
+        the shared HTTP Client
     log : QSLog
         Logging Descriptor
     debug: bool, default: False
         debug mechanism
+    daemonSets: dict, default: DAEMONSETS
+        daemonsets to check by name with their expected replicas
+    watermarks: LogWatermarks, default: None
+        watermarks of the istiod logs. Kept across cycles
+    logWindow: int, default: 10
+        number of log lines before a warning for the most frequent words
+    stopWords: List[str], default: None
+        words ignored for the most frequent words. None uses analyze.STOP_WORDS
+    templates: TemplateIndex, default: None
+        templates of the istiod warnings. Kept across cycles
+    cadence: Cadence, default: None
+        intervals of the checks. None runs every check
+    analysis: AnalysisPool, default: None
+        analyzes the istiod logs. None analyzes them inline
     '''
     
-    def __init__(self, url: str, token: str, log: QSLog, limits:ResourceLimits,  debug_:bool=False, verify:bool=False) -> None:
+    def __init__(self, url: str, client: HTTPClient, log: QSLog, limits:ResourceLimits,  debug_:bool=False, daemonSets:dict=None, watermarks:LogWatermarks=None, logWindow:int=10, stopWords:List[str]=None, templates:TemplateIndex=None, cadence:Cadence=None, analysis:AnalysisPool=None) -> None:
         self.__url = url
         self.__limits = limits
-        self.__token = token
+        self.__daemonSets = daemonSets if daemonSets is not None else DAEMONSETS
+        self.__pods = {}
+        self.__watermarks = watermarks if watermarks is not None else LogWatermarks()
+        self.__logWindow = logWindow
+        self.__stopWords = stopWords
+        self.__templates = templates if templates is not None else TemplateIndex()
+        self.__cadence = cadence
+        self.__analysis = analysis if analysis is not None else AnalysisPool()
+        self.__client = client
         self.__debug = debug_
-        self.__verify = verify
         self.__log = log
 
 
-    def __getk8s(self, url:str) -> Any:
+    def __getk8s(self, url:str, cache:bool=True) -> Any:
         base = self.__url.replace("v3", "k8s")
         url = f"{base}{url}"
         if self.__debug:
             print(f"GET {url}")
-        response = get(url=url, headers={"Authorization": "Bearer {}".format(self.__token)}, verify=self.__verify) #self.__debug
+        response = self.__client.get(url=url, cache=cache)
         try:
             data = response.json()
             if "items" in data.keys():
@@ -92,6 +131,24 @@ class Manager():
                 return logs
             return None
 
+    def __streamk8s(self, cluster:Cluster, check:str, url:str, params:dict) -> Iterable[str]:
+        '''
+        Streams a text response of the k8s proxy line by line. A response other than 200 warns the check
+        '''
+        base = self.__url.replace("v3", "k8s")
+        url = f"{base}{url}"
+        if self.__debug:
+            print(f"GET {url} [{params=}]")
+        with self.__client.get(url=url, params=params, stream=True) as response:
+            if response.status_code != 200:
+                self.__log.event(Severity.WARN, cluster.name, check, f"Cluster {cluster.name} could not read {url}: HTTP {response.status_code}")
+                return
+            # the log endpoint sends text/plain without charset, which requests would decode as ISO-8859-1
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield line
+
     def __get(self, url:str) -> Any:
         '''
         Get Raw URLs
@@ -107,21 +164,46 @@ class Manager():
         '''
         url = f"{self.__url}{url}"
         try:
-            response = get(url=url, headers={"Authorization": "Bearer {}".format(self.__token)}, verify=self.__verify) # self.__debug
+            response = self.__client.get(url=url, cache=True)
             if response.status_code == 200:
                 data = response.json()
                 if "data" in data.keys():
                     return data["data"]
                 return data
             return None
+        except Skipped:
+            raise
         except Exception as e:
-            print(e)
+            self.__log.print(e)
             return None
 
+    def pods(self, clusterId: str, namespace: str, labelSelector: str) -> list:
+        '''
+        Pod snapshot per cluster, namespace and label selector. Each list is loaded once per Manager and shared by all checks.
+
+        Params
+        ------
+        clusterId : str
+            the Rancher ClusterID
+        namespace : str
+            the namespace of the pods
+        labelSelector : str
+            the label selector, e.g. app=istiod
+
+        Returns
+        -------
+        list
+            the pods including their spec. Empty if not reachable
+        '''
+        key = (clusterId, namespace, labelSelector)
+        if key not in self.__pods:
+            self.__pods[key] = self.__getk8s(f"/clusters/{clusterId}/api/v1/namespaces/{namespace}/pods?labelSelector={labelSelector}") or []
+        return self.__pods[key]
+
     def runNodeQS(self, cluster: Cluster) -> None:
-        nodes = self.__get(f"/clusters/{cluster.id}/nodes")
+        nodes = cluster.nodes
         if not nodes:
-            self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} not reachable...")
+            self.__log.event(Severity.FAILED, cluster.name, "nodes", f"Cluster {cluster.name} not reachable...")
         else:
             fails = []
             for node in nodes:
@@ -130,62 +212,61 @@ class Manager():
                 if conditionMet:
                     fails.append((node["nodeName"], conditionMet))
             if fails:
-                self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} failed with nodes: {fails}")
+                self.__log.event(Severity.FAILED, cluster.name, "nodes", f"Cluster {cluster.name} failed with nodes: {fails}")
             else:
-                self.__log.write(f"[ \033[0;32mOK\033[0m ]\t\tCluster {cluster.name} passed Node inspection.")
+                self.__log.event(Severity.OK, cluster.name, "nodes", f"Cluster {cluster.name} passed Node inspection.")
 
-    def runPrometheusInspection(self, cluster: Cluster, nsSystemId: str) -> None:
+    def daemonSets(self, nsSystemId: str) -> dict:
         '''
-        Check Prometheus and check scaling of Nodes
-        
+        Index of all daemonsets in the System project. Loaded with one request.
+
         Params
         ------
-        cluster : dict
-            cluster information
         nsSystemId: str
             the ID of Rancher Project System
+
+        Returns
+        -------
+        dict
+            daemonsets by name. None if not reachable
         '''
-        if not nsSystemId:
-            self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} not reachable...")
-        else:
-            #provSet = self.__get(f"/projects/{nsSystemId}/daemonsets?name=prometheus-node-exporter")
-            provSet = self.__get(f"/projects/{nsSystemId}/daemonsets?name=rancher-monitoring-prometheus-node-exporter")
-            if not provSet:
-                self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} Prometheus Scaling. Desired: {cluster.n_nodes} | Available: NONE")
-                return
-            status = provSet[0]["daemonSetStatus"]
-            if len({status['currentNumberScheduled'], status['desiredNumberScheduled'], status['numberAvailable'], cluster.n_nodes}) == 1:
-                self.__log.write(f"[ \033[0;32mOK\033[0m ]\t\tCluster {cluster.name} passed Prometheus scaling.")
-            else:
-                self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} Prometheus Scaling. Desired: {cluster.n_nodes} | Available: {status['numberAvailable']}")
+        daemonSets = self.__get(f"/projects/{nsSystemId}/daemonsets")
+        if daemonSets is None:
+            return None
+        return {ds["name"]: ds for ds in daemonSets}
 
-    def runIstioCNIInspection(self, cluster: Cluster, nsSystemId: str):
+    def runDaemonSetInspection(self, cluster: Cluster, name: str, rule: Any, daemonSets: dict) -> None:
         '''
-        Check istio CNI and check scaling of Nodes
-        
+        Check the scaling of a daemonset
+
         Params
         ------
-        cluster : dict
+        cluster : Cluster
             cluster information
-        nsSystemId: str
-            the ID of Rancher Project System
+        name : str
+            the name of the daemonset
+        rule : str or int
+            expected replicas. "nodes" for one replica per node
+        daemonSets: dict
+            index of the daemonsets in the System project
         '''
-        if not nsSystemId:
-            self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} not reachable...")
+        label = DAEMONSET_LABELS.get(name, name)
+        expected = cluster.n_nodes if rule == "nodes" else int(rule)
+        if daemonSets is None:
+            self.__log.event(Severity.FAILED, cluster.name, f"daemonset:{name}", f"Cluster {cluster.name} not reachable...")
+            return
+        if name not in daemonSets:
+            self.__log.event(Severity.FAILED, cluster.name, f"daemonset:{name}", f"Cluster {cluster.name} {label} Scaling. Desired: {expected} | Available: NONE")
+            return
+        status = daemonSets[name]["daemonSetStatus"]
+        if len({status['currentNumberScheduled'], status['desiredNumberScheduled'], status['numberAvailable'], expected}) == 1:
+            self.__log.event(Severity.OK, cluster.name, f"daemonset:{name}", f"Cluster {cluster.name} passed {label} scaling.")
         else:
-            provSet = self.__get(f"/projects/{nsSystemId}/daemonsets?name=istio-cni-node")
-            if not provSet:
-                self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} Istio CNI Scaling. Desired: {cluster.n_nodes} | Available: NONE")
-                return
-            status = provSet[0]["daemonSetStatus"]
-            if len({status['currentNumberScheduled'], status['desiredNumberScheduled'], status['numberAvailable'], cluster.n_nodes}) == 1:
-                self.__log.write(f"[ \033[0;32mOK\033[0m ]\t\tCluster {cluster.name} passed Istio CNI scaling.")
-            else:
-                self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} Istio CNI Scaling. Desired: {cluster.n_nodes} | Available: {status['numberAvailable']}")
+            self.__log.event(Severity.FAILED, cluster.name, f"daemonset:{name}", f"Cluster {cluster.name} {label} Scaling. Desired: {expected} | Available: {status['numberAvailable']}")
 
-    def runCanalInspection(self, cluster: Cluster, nsSystemId: str) -> None:
+    def runDaemonSetsInspection(self, cluster: Cluster, nsSystemId: str) -> None:
         '''
-        Check Canal and check scaling of Nodes
+        Check the scaling of all configured daemonsets, e.g. Prometheus node-exporter, Canal and Istio CNI
         
         Params
         ------
@@ -195,17 +276,11 @@ class Manager():
             the ID of Rancher Project System
         '''
         if not nsSystemId:
-            self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} not reachable...")
-        else:
-            provSet = self.__get(f"/projects/{nsSystemId}/daemonsets?name=canal")
-            if not provSet:
-                self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} Canal Scaling. Desired: {cluster.n_nodes} | Available: NONE")
-                return
-            status = provSet[0]["daemonSetStatus"]
-            if len({status['currentNumberScheduled'], status['desiredNumberScheduled'], status['numberAvailable'], cluster.n_nodes}) == 1:
-                self.__log.write(f"[ \033[0;32mOK\033[0m ]\t\tCluster {cluster.name} passed Canal scaling.")
-            else:
-                self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} Canal Scaling. Desired: {cluster.n_nodes} | Available: {status['numberAvailable']}")
+            self.__log.event(Severity.FAILED, cluster.name, "daemonsets", f"Cluster {cluster.name} not reachable...")
+            return
+        daemonSets = self.daemonSets(nsSystemId)
+        for name, rule in self.__daemonSets.items():
+            self.runDaemonSetInspection(cluster, name, rule, daemonSets)
 
     def checkPrometheus(self, cluster:Cluster, nsSystemId: str) -> None:
         '''
@@ -219,17 +294,17 @@ class Manager():
             the ID of Rancher Project System
         '''
         if not nsSystemId:
-            self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} not reachable...")
+            self.__log.event(Severity.FAILED, cluster.name, "prometheusDeployments", f"Cluster {cluster.name} not reachable...")
         else:
             provSet = self.__get(f"/projects/{nsSystemId}/workloads?namespaceId=cattle-monitoring-system")
             if not provSet:
-                self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} has failed Prometheus deployments. No Deployments with active status.")
+                self.__log.event(Severity.FAILED, cluster.name, "prometheusDeployments", f"Cluster {cluster.name} has failed Prometheus deployments. No Deployments with active status.")
                 return
             if any(deployment["state"] != 'active' for deployment in provSet):
                 fails = [deployment["name"] for deployment in provSet if deployment["state"] != 'active']
-                self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} has failed Prometheus deployments: {fails}")
+                self.__log.event(Severity.FAILED, cluster.name, "prometheusDeployments", f"Cluster {cluster.name} has failed Prometheus deployments: {fails}")
             else:
-                self.__log.write(f"[ \033[0;32mOK\033[0m ]\t\tCluster {cluster.name} has all Prometheus deployments.")
+                self.__log.event(Severity.OK, cluster.name, "prometheusDeployments", f"Cluster {cluster.name} has all Prometheus deployments.")
             
     def checkMonitoring(self, cluster:Cluster, nsMonitoringId: str) -> None:
         '''
@@ -256,25 +331,36 @@ class Manager():
             return versions
 
         if not nsSystemId:
-            self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} not reachable...")
+            self.__log.event(Severity.FAILED, cluster.name, "istiodLogs", f"Cluster {cluster.name} not reachable...")
         else:
             splashes = []
-            pods = self.__getk8s(f"/clusters/{nsSystemId.split(':')[0]}/api/v1/namespaces/istio-system/pods?labelSelector=app=istiod")
+            pods = self.pods(nsSystemId.split(':')[0], "istio-system", "app=istiod")
             # allows checking of istiod deployments :)
             # min pods == 1
-            print("Anzahl der Pods: ", len(pods))
+            self.__log.print("Anzahl der Pods: ", len(pods))
             if len(pods) < 1:
-                self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} deployed too few istiod pods")
+                self.__log.event(Severity.FAILED, cluster.name, "istiodPods", f"Cluster {cluster.name} deployed too few istiod pods")
             else:
                 for k,v in getIstioVersion(pods).items():
-                    self.__log.write(f"[ \033[0;32mOK\033[0m ]\t\tCluster {cluster.name} deployed {v['count']} {k}-istiod pods with image_tags {v['image_tag']}")
+                    self.__log.event(Severity.OK, cluster.name, "istiodPods", f"Cluster {cluster.name} deployed {v['count']} {k}-istiod pods with image_tags {v['image_tag']}")
+            clusterId = nsSystemId.split(':')[0]
+            containers = []
             for pod in pods:
                 podID = pod["metadata"]["name"]
-                logs = self.__getk8s(f"/clusters/{nsSystemId.split(':')[0]}/api/v1/namespaces/istio-system/pods/{podID}/log?sinceSeconds=70")
-                if logs:
-                    logsplash = IstioDAnalyze(logs=logs).analyze()
-                    if len(logsplash) > 0:
-                        splashes.extend(logsplash)
+                container = next((c["name"] for c in pod["spec"]["containers"] if c["name"] == "discovery"), pod["spec"]["containers"][0]["name"])
+                restarts = next((c.get("restartCount", 0) for c in pod.get("status", {}).get("containerStatuses", []) if c["name"] == container), 0)
+                key = (clusterId, podID, pod["metadata"].get("uid"), container)
+                containers.append(key)
+                mark, lastRestarts = self.__watermarks.get(key)
+                # the container restarted since the last cycle -> read the rest of the previous container first
+                previous = [True] if mark is not None and lastRestarts is not None and restarts > lastRestarts else []
+                for prev in previous + [False]:
+                    params = dict(self.__watermarks.params(key), container=container, timestamps="true")
+                    if prev:
+                        params["previous"] = "true"
+                    lines = self.__streamk8s(cluster, "istiodLogs", f"/clusters/{clusterId}/api/v1/namespaces/istio-system/pods/{podID}/log", params)
+                    splashes.extend(self.__analysis.analyze(self.__watermarks.tail(lines, key, restarts), window=self.__logWindow, stopWords=self.__stopWords))
+            self.__watermarks.prune(clusterId, containers)
             if splashes:
                 splashes = [
                     dataInject(splash, {
@@ -282,10 +368,22 @@ class Manager():
                         "id": cluster.id
                     }) for splash in splashes
                 ]
-                istioSplash = list(set([splash['trace'] for splash in splashes]))
-                self.__log.write(f"[ \033[1;33mWARN\033[0m ]\tCluster {cluster.name} has failed istiod logs {istioSplash}")
+                newTemplates, knownTemplates, counts = {}, {}, {}
+                for splash in splashes:
+                    template, new = self.__templates.add(splash['trace'], cluster.name)
+                    templates = newTemplates if new or template.id in newTemplates else knownTemplates
+                    templates[template.id] = template
+                    counts[template.id] = counts.get(template.id, 0) + 1
+                knownNoise = {t.template: counts[id] for id, t in knownTemplates.items() if id not in newTemplates}
+                if knownNoise:
+                    self.__log.event(Severity.INFO, cluster.name, "istiodLogs", f"Cluster {cluster.name} has known istiod log noise {knownNoise}")
+                if newTemplates:
+                    istioSplash = [t.template for t in newTemplates.values()]
+                    self.__log.event(Severity.WARN, cluster.name, "istiodLogs", f"Cluster {cluster.name} has failed istiod logs {istioSplash}")
+                else:
+                    self.__log.event(Severity.OK, cluster.name, "istiodLogs", f"Cluster {cluster.name} passed istiod-logs. Only known noise.")
             else:
-                self.__log.write(f"[ \033[0;32mOK\033[0m ]\t\tCluster {cluster.name} passed istiod-logs.")
+                self.__log.event(Severity.OK, cluster.name, "istiodLogs", f"Cluster {cluster.name} passed istiod-logs.")
 
     def checkRessources(self, cluster: Cluster, nsSystemId: str, selector: WorkloadSelector):
         def compareResource(limit, value):
@@ -306,37 +404,33 @@ class Manager():
             diffRAM=compareRAM(limit["memory"],value["memory"])
             return diffCPU&diffRAM, {"cpu": diffCPU, "memory": diffRAM, "input": (limit,value)}
         if not all([nsSystemId, selector]):
-            self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} not reachable...")
+            self.__log.event(Severity.FAILED, cluster.name, f"resources:{selector.value}", f"Cluster {cluster.name} not reachable...")
         else:
-            workloads = self.__getk8s(f"/clusters/{nsSystemId.split(':')[0]}/api/v1/namespaces/{selector.namespace}/pods?labelSelector={selector.key}={selector.value}")
+            workloads = self.pods(nsSystemId.split(':')[0], selector.namespace, selector.labelSelector)
             if len(workloads)==0:
                 # no workload found...
-                self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} has no Ressources with {selector.key}:{selector.value} in Namespace: {selector.namespace}")
+                self.__log.event(Severity.FAILED, cluster.name, f"resources:{selector.value}", f"Cluster {cluster.name} has no Ressources with {selector.key}:{selector.value} in Namespace: {selector.namespace}")
                 return
             diffs = []
             for workload in workloads:
-                ID = workload["metadata"]["name"]
-                data = self.__getk8s(f"/clusters/{nsSystemId.split(':')[0]}/api/v1/namespaces/{selector.namespace}/pods/{ID}")
                 # get first container
-                container = data["spec"]["containers"][0]
+                container = workload["spec"]["containers"][0]
                 diff = compareResource(self.__limits.get(selector.value), container["resources"]["limits"])
                 diffs.append(diff)
             if not all(d[0] for d in diffs):
                 for diff in diffs:
                     if not diff[0]:
-                        self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} has failed RessourceCheck {selector.value} with {diff[1]}")
+                        self.__log.event(Severity.FAILED, cluster.name, f"resources:{selector.value}", f"Cluster {cluster.name} has failed RessourceCheck {selector.value} with {diff[1]}")
             else:
-                self.__log.write(f"[ \033[0;32mOK\033[0m ]\t\tCluster {cluster.name} passed RessourceCheck {selector.value}.")
+                self.__log.event(Severity.OK, cluster.name, f"resources:{selector.value}", f"Cluster {cluster.name} passed RessourceCheck {selector.value}.")
 
     def checkVolumes(self, cluster: Cluster, nsSystemId: str, selector: WorkloadSelector) -> None:
         if not all([nsSystemId, selector]):
-            self.__log.write(f"[\033[0;31mFailed\033[0m]\tCluster {cluster.name} not reachable...")
+            self.__log.event(Severity.FAILED, cluster.name, f"volumes:{selector.value}", f"Cluster {cluster.name} not reachable...")
         else:
-            workloads = self.__getk8s(f"/clusters/{nsSystemId.split(':')[0]}/api/v1/namespaces/{selector.namespace}/pods?labelSelector={selector.key}={selector.value}")
+            workloads = self.pods(nsSystemId.split(':')[0], selector.namespace, selector.labelSelector)
             for workload in workloads:
-                ID = workload["metadata"]["name"]
-                data = self.__getk8s(f"/clusters/{nsSystemId.split(':')[0]}/api/v1/namespaces/{selector.namespace}/pods/{ID}")
-                volumes = data["spec"]["volumes"]
+                volumes = workload["spec"]["volumes"]
                 pvs = [v["persistentVolumeClaim"]["claimName"] for v in volumes if "persistentVolumeClaim" in v.keys()]
 
     def checkLifeTime(self, cluster: dict, nsSystemId:str) -> None:
@@ -363,6 +457,25 @@ class Manager():
         ret =  {k:cond["status"] for k,t in test.items() for cond in nodeConditions if (cond["type"]==k and cond["status"]!=t)}
         return ret
     
+    def runClusterQS(self, cluster:Cluster):
+        '''
+        Runs all Manager checks for a single cluster
+
+        Params
+        ------
+        cluster : Cluster
+            the cluster to scrape from
+        '''
+        runCheck("manager", self.__cadence, self.__log, cluster, "nodes", lambda: self.runNodeQS(cluster=cluster))
+        runCheck("manager", self.__cadence, self.__log, cluster, "daemonsets", lambda: self.runDaemonSetsInspection(cluster=cluster, nsSystemId=cluster.systemProjectId))
+        runCheck("manager", self.__cadence, self.__log, cluster, "prometheusDeployments", lambda: self.checkPrometheus(cluster=cluster, nsSystemId=cluster.systemProjectId))
+        runCheck("manager", self.__cadence, self.__log, cluster, "istiod", lambda: self.istioDlogs(cluster=cluster, nsSystemId=cluster.systemProjectId))
+        runCheck("manager", self.__cadence, self.__log, cluster, "resources", lambda: self.__checkAllRessources(cluster))
+
+    def __checkAllRessources(self, cluster:Cluster) -> None:
+        self.checkRessources(cluster, nsSystemId=cluster.systemProjectId, selector=WorkloadSelector(namespace="istio-system", key="app", value="istio-ingressgateway"))
+        self.checkRessources(cluster, nsSystemId=cluster.systemProjectId, selector=WorkloadSelector(namespace="cattle-monitoring-system", key="prometheus", value="rancher-monitoring-prometheus"))
+
     def runQS(self, clusters:List[Cluster]):
         '''
         Main handler for QS Runtime
@@ -373,17 +486,5 @@ class Manager():
             list of clusters to scrape from
         '''
         for cluster in clusters:
-            print("--------\n[ \033[1;35mChecking\033[0m ] {}".format(cluster.name))
-            #nsSystemId = self.__get(f"/clusters/{cluster.id}/projects?name=System")
-            nsSystemId = self.__get(f"/clusters/{cluster.id}/projects?name=System")
-            nsSystemId = nsSystemId[0]["id"]
-            self.runNodeQS(cluster=cluster)
-            self.runPrometheusInspection(cluster=cluster, nsSystemId=nsSystemId)
-            self.runCanalInspection(cluster=cluster, nsSystemId=nsSystemId)
-            self.checkPrometheus(cluster=cluster, nsSystemId=nsSystemId)
-            self.runIstioCNIInspection(cluster=cluster, nsSystemId=nsSystemId)
-            self.istioDlogs(cluster=cluster, nsSystemId=nsSystemId)
-            self.checkRessources(cluster, nsSystemId=nsSystemId, selector=WorkloadSelector(namespace="istio-system", key="app", value="istio-ingressgateway"))
-            self.checkRessources(cluster, nsSystemId=nsSystemId, selector=WorkloadSelector(namespace="cattle-monitoring-system", key="prometheus", value="rancher-monitoring-prometheus"))
-
-    
\ No newline at end of file
+            self.__log.checking(cluster.name)
+            self.runClusterQS(cluster)
@@ -0,0 +1,106 @@
+#!/bin/python
+
+from contextlib import contextmanager
+from typing import Tuple
+from urllib.parse import urlsplit
+import re
+import threading
+import time
+from prometheus_client import Counter, Histogram
+
+
+h_check = Histogram("opserver_check_duration_seconds", "Duration of a check on a cluster", ['step', 'check', 'cluster'],
+                    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf")))
+h_http = Histogram("opserver_http_request_duration_seconds", "Duration of HTTP requests by target and status", ['cluster', 'path', 'status'],
+                   buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf")))
+c_http_bytes = Counter("opserver_http_response_bytes", "Received HTTP response bytes by target", ['cluster', 'path'])
+
+OTHER = "other"
+
+# path segments replaced by placeholders. Rancher and k8s IDs of clusters and projects and the names of k8s objects
+PATH_TEMPLATES = [
+    (re.compile(r"/{2,}"), "/"),
+    (re.compile(r"/clusters/(c-[a-z0-9]+|local)(?=/|$)"), "/clusters/{cluster}"),
+    (re.compile(r"/projects/(c-[a-z0-9]+|local):p-[a-z0-9]+(?=/|$)"), "/projects/{project}"),
+    (re.compile(r"/namespaces/[^/]+"), "/namespaces/{namespace}"),
+    (re.compile(r"/(pods|deployments|daemonsets|workloads|services)/[^/]+"), r"/\1/{name}"),
+]
+CLUSTER_ID = re.compile(r"(?:/clusters/|/projects/)(c-[a-z0-9]+|local)(?=[/:]|$)")
+
+
+class LabelLimiter():
+    '''Label Cardinality Cap
+
+    Passes the first `limit` distinct values of a label and maps all further values to `other`.
+
+    Attributes
+    ----------
+    limit : int, default: 100
+        maximum number of distinct values
+    '''
+
+    def __init__(self, limit: int=100) -> None:
+        self.limit = limit
+        self.__values = set()
+        self.__lock = threading.Lock()
+
+    def __call__(self, value: str) -> str:
+        if value in self.__values:
+            return value
+        with self.__lock:
+            if len(self.__values) >= self.limit:
+                return OTHER
+            self.__values.add(value)
+        return value
+
+
+# cluster names of the checks, cluster IDs or hosts of the requests and path templates
+clusterNames = LabelLimiter()
+targets = LabelLimiter()
+paths = LabelLimiter()
+
+
+def configure(labelLimit: int) -> None:
+    '''
+    Sets the maximum number of distinct values per cluster and path label
+    '''
+    for limiter in (clusterNames, targets, paths):
+        limiter.limit = labelLimit
+
+
+def endpoint(url: str) -> Tuple[str, str]:
+    '''
+    Returns the cluster and the path template of a URL. The cluster is the Rancher cluster ID in the path or the host
+    '''
+    parts = urlsplit(url)
+    match = CLUSTER_ID.search(parts.path)
+    path = parts.path
+    for pattern, template in PATH_TEMPLATES:
+        path = pattern.sub(template, path)
+    return match.group(1) if match else parts.netloc, path
+
+
+def target(url: str) -> Tuple[str, str]:
+    '''
+    Returns the cluster and the path template of a URL as capped label values
+    '''
+    cluster, path = endpoint(url)
+    return targets(cluster), paths(path)
+
+
+def observeRequest(url: str, status: str, duration: float, size: int) -> None:
+    cluster, path = target(url)
+    h_http.labels(cluster, path, status).observe(duration)
+    c_http_bytes.labels(cluster, path).inc(size)
+
+
+@contextmanager
+def timed(step: str, check: str, cluster: str):
+    '''
+    Observes the duration of a check on a cluster
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        h_check.labels(step, check, clusterNames(cluster)).observe(time.perf_counter() - start)
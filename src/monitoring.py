@@ -2,9 +2,10 @@
 
 import re
 from typing import List
-from requests import get
-from faillog import QSLog
+from faillog import QSLog, Severity
 from clusters import Cluster
+from httpclient import HTTPClient, Skipped
+from cadence import Cadence, runCheck
 
 class Monitor():
     '''CHeck QS Monitoring
@@ -13,42 +14,55 @@ class Monitor():
     ----------
     url: str
         the cluster rancher URL
+    client : HTTPClient
+        the shared HTTP Client
     log : QSLog
         Logging Descriptor
     debug: bool, default: False
         debug mechanism
+    cadence: Cadence, default: None
+        intervals of the checks. None runs every check
     '''
-    def __init__(self, url:str,  log: QSLog, debug_:bool=False, verify:bool=False) -> None:
+    def __init__(self, url:str, client: HTTPClient, log: QSLog, debug_:bool=False, cadence:Cadence=None) -> None:
         self.__debug = debug_
+        self.__cadence = cadence
         self.__dashboards = ["Tester-Status-Neu Rancher / Node"] 
         self.__log = log
-        self.__verify = verify
+        self.__client = client
+
+    def runClusterQS(self, cluster:Cluster) -> None:
+        '''
+        Runs all Monitoring checks for a single cluster
+        '''
+        __cluster = f"{cluster.base}/monitoring/"
+        urls = [__cluster]
+        for url in urls:
+            # prometheus
+            prometheus = "{}prometheus/".format(url)
+            runCheck("monitoring", self.__cadence, self.__log, cluster, "prometheus", lambda: self.__log.event(self.__checkStatus(prometheus)[0], cluster.name, "prometheus", prometheus))
+            # alertmanager
+            alertmanager = "{}alertmanager/".format(url)
+            runCheck("monitoring", self.__cadence, self.__log, cluster, "alertmanager", lambda: self.__log.event(self.__checkStatus(alertmanager)[0], cluster.name, "alertmanager", alertmanager))
+            # grafana
+            runCheck("monitoring", self.__cadence, self.__log, cluster, "grafana", lambda: self.__checkGrafana(cluster, "{}grafana/".format(url)))
+
+    def __checkGrafana(self, cluster:Cluster, grafana:str) -> None:
+        dashboards = "{}api/search".format(grafana)
+        status = self.__checkStatus(grafana)
+        if status[1] == 200 and not self.__checkDashboards(dashboards):
+            self.__log.event(Severity.WARN, cluster.name, "grafana", "{} Dashboards Missing...".format(grafana))
+        else:
+            self.__log.event(status[0], cluster.name, "grafana", grafana)
 
     def runQS(self, clusters:List[Cluster]) -> None:
         '''
         Main Handler Function for QS
         '''
         for cluster in clusters:
-            __cluster = f"{cluster.base}/monitoring/"
-            print("--------\n[ \033[1;35mChecking\033[0m ] {}".format(cluster.name))
-            urls = [__cluster]
-            for url in urls:
-                # prometheus
-                prometheus = "{}prometheus/".format(url)
-                self.__log.write("{}\t {}".format(self.__checkStatus(prometheus)[0], prometheus))
-                # alertmanager
-                alertmanager = "{}alertmanager/".format(url)
-                self.__log.write("{}\t {}".format(self.__checkStatus(alertmanager)[0], alertmanager))
-                # grafana
-                grafana = "{}grafana/".format(url)
-                dashboards = "{}api/search".format(grafana)
-                status = self.__checkStatus(grafana)
-                if status[1] == 200 and not self.__checkDashboards(dashboards):
-                    self.__log.write("[\033[1;33mWARN\033[0m]\t\t {} Dashboards Missing...".format(grafana))
-                else:
-                    self.__log.write("{}\t {}".format(status[0], grafana))
+            self.__log.checking(cluster.name)
+            self.runClusterQS(cluster)
 
-    def __checkStatus(self, url: str) -> list[str,int]:
+    def __checkStatus(self, url: str) -> list[Severity,int]:
         '''
         Checking the Status of Dashboard URLS
 
@@ -59,24 +73,26 @@ class Monitor():
         
         Returns
         -------
-        list : [str, int]
-            Formatted Response and Response Code
+        list : [Severity, int]
+            Severity and Response Code
         '''
         if self.__debug:
             print(f"GET {url}")
         # add a catch statement, if anything goes wrong at this point
         try:
-            response = get(url, verify=self.__verify).status_code
+            response = self.__client.get(url, auth=False).status_code
             if response == 200:
-                return ["[ \033[0;32mOK\033[0m ]\t", response]
+                return [Severity.OK, response]
             # extract 500+ as warning -> bad Gateway -> fixable
             elif response%400 > 99:
-                return ["[\033[1;33mWARN\033[0m]\t", response]
+                return [Severity.WARN, response]
             else:
-                return ["[\033[0;31mFailed\033[0m]", response]
+                return [Severity.FAILED, response]
+        except Skipped:
+            raise
         except Exception as e:
-            print(e)
-        return ["[\33[0;31mFailed\033[0m]", f"URL {url} not found."]
+            self.__log.print(e)
+        return [Severity.FAILED, f"URL {url} not found."]
 
     def __checkDashboards(self, url: str) -> bool:
         '''
@@ -96,14 +112,16 @@ class Monitor():
             print(f"GET {url}")
         # add a catch statement, if anything goes wrong at this point
         try:
-            response = get(url, verify=self.__verify)
+            response = self.__client.get(url, auth=False)
             if self.__debug:
                 print(response.json())
             else:
                 if any(e["title"] in self.__dashboards for e in response.json()):
                     return True
+        except Skipped:
+            raise
         except Exception as e:
-            print(e)    
+            self.__log.print(e)
         return False
         
             
\ No newline at end of file
@@ -0,0 +1,84 @@
+#!/bin/python
+
+from typing import Callable
+import random
+import threading
+import time
+from prometheus_client import Counter, Gauge
+
+
+g_lag = Gauge("opserver_schedule_lag_seconds", "Seconds the last cycle started after its scheduled time")
+c_skipped = Counter("opserver_cycles_skipped", "Scheduled cycles not run because the previous cycle was still running")
+
+MODES = ("rate", "delay")
+OVERRUNS = ("skip", "coalesce")
+
+
+class Scheduler():
+    '''Cycle Scheduler
+
+    Runs a task periodically on the monotonic clock. The thread sleeps between the cycles.
+
+    In `rate` mode the cycles start at fixed times `interval` seconds apart, so a cycle does not drift by the duration
+    of the previous ones. A cycle running longer than the interval overruns the next start times. `skip` drops the
+    missed cycles and waits for the next start time, `coalesce` runs the missed cycles as one cycle right away.
+    In `delay` mode a cycle starts `interval` seconds after the previous one finished.
+
+    Attributes
+    ----------
+    interval : float, default: 60
+        seconds between cycles
+    mode : str, default: rate
+        `rate` or `delay`
+    jitter : float, default: 0
+        maximum random seconds added to each start time, to spread the load of several instances
+    overrun : str, default: skip
+        `skip` or `coalesce`
+    '''
+
+    def __init__(self, interval: float=60, mode: str="rate", jitter: float=0, overrun: str="skip") -> None:
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        if overrun not in OVERRUNS:
+            raise ValueError(f"overrun must be one of {OVERRUNS}")
+        self.__interval = interval
+        self.__mode = mode
+        self.__jitter = jitter
+        self.__overrun = overrun
+        self.__stop = threading.Event()
+
+    @property
+    def stopped(self) -> bool:
+        return self.__stop.is_set()
+
+    def stop(self, *args) -> None:
+        '''
+        Stops after the running cycle. Can be used as signal handler
+        '''
+        self.__stop.set()
+
+    def run(self, task: Callable[[], None]) -> None:
+        '''
+        Runs the task until `stop` is called. The first cycle starts right away
+        '''
+        slot = time.monotonic()
+        while not self.__stop.is_set():
+            start = slot + random.uniform(0, self.__jitter) if self.__jitter else slot
+            if self.__stop.wait(max(start - time.monotonic(), 0)):
+                break
+            g_lag.set(max(time.monotonic() - start, 0))
+            task()
+            now = time.monotonic()
+            if self.__mode == "delay":
+                slot = now + self.__interval
+                continue
+            slot += self.__interval
+            if slot < now:
+                missed = int((now - slot) // self.__interval) + 1
+                if self.__overrun == "skip":
+                    slot += missed * self.__interval
+                    c_skipped.inc(missed)
+                else:
+                    # the last missed cycle runs right away and stands for all missed ones
+                    slot += (missed - 1) * self.__interval
+                    c_skipped.inc(missed - 1)
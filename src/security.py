@@ -1,3 +1,4 @@
+from functools import lru_cache
 import secure
 
 def secure_headers():
@@ -16,4 +17,13 @@ def secure_headers():
             .object_src("'none'")
             .base_uri("'none'"))
     return secure.Secure(hsts=hsts, cache=cache, referrer=referrer, csp=csp, xxp=xxss)
-    
\ No newline at end of file
+    
+
+@lru_cache(maxsize=1)
+def securityHeaders() -> dict:
+    '''
+    The security headers of every response. Built once
+    '''
+    headers = secure_headers().headers()
+    headers["X-Download-Options"] = "noopen"
+    return headers
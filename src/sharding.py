@@ -0,0 +1,150 @@
+#!/bin/python
+
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from hashlib import blake2b
+from typing import List, Optional
+import re
+import threading
+import time
+from requests import Session
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing():
+    '''Consistent Hash Ring
+
+    Maps keys to members. Each member owns `replicas` points on the ring and a key belongs to the member of the next
+    point. Adding a member only moves the keys of the points it takes over, about 1/n of all keys.
+
+    Attributes
+    ----------
+    members : List[str]
+        the members of the ring
+    replicas : int, default: 128
+        points per member. More points spread the keys more evenly
+    '''
+
+    def __init__(self, members: List[str], replicas: int=128) -> None:
+        if not members:
+            raise ValueError("the ring needs at least one member")
+        points = sorted((_hash(f"{member}#{i}"), member) for member in members for i in range(replicas))
+        self.__hashes = [point for point, _ in points]
+        self.__members = [member for _, member in points]
+
+    def owner(self, key: str) -> str:
+        '''
+        Returns the member owning the key
+        '''
+        index = bisect_right(self.__hashes, _hash(key)) % len(self.__hashes)
+        return self.__members[index]
+
+
+def ordinal(hostname: str) -> Optional[int]:
+    '''
+    The ordinal index of a StatefulSet pod from its hostname, e.g. 2 for opserver-2. None if there is none
+    '''
+    match = re.search(r"-(\d+)$", hostname or "")
+    return int(match.group(1)) if match else None
+
+
+def assign(clusters: List[dict], index: int, count: int) -> List[dict]:
+    '''
+    Returns the configured clusters checked by shard `index` of `count` shards. The clusters are assigned by name
+    '''
+    if count <= 1:
+        return list(clusters)
+    ring = HashRing([f"shard-{i}" for i in range(count)])
+    return [cluster for cluster in clusters if ring.owner(cluster["name"]) == f"shard-{index}"]
+
+
+def merge(summaries: List[dict]) -> dict:
+    '''
+    Merges the `/v1/summarize` responses of several shards into one. The last run is the oldest last run of the shards
+
+    Params
+    ------
+    summaries : List[dict]
+        the responses. Shards without a finished run answer with empty counts
+    '''
+    now = time.time()
+    descriptions = {"fails": [], "warnings": [], "success": []}
+    results = []
+    lastRuns = []
+    for summary in summaries:
+        for key, description in descriptions.items():
+            if summary.get(key):
+                description.extend(summary[key]["description"])
+        results.extend(summary.get("results") or [])
+        if summary.get("lastRun"):
+            lastRuns.append(summary["lastRun"])
+    total = sum(len(description) for description in descriptions.values())
+    lastRun = min(lastRuns) if lastRuns else None
+    return {
+        "cluster": summaries[0].get("cluster") if summaries else None,
+        "time": now,
+        "time_hr": time.strftime("%X %x"),
+        "lastRun": lastRun,
+        "lastRun_hr": datetime.fromtimestamp(lastRun).strftime("%X %x") if lastRun else None,
+        **{key: {"description": description, "count": len(description)} for key, description in descriptions.items()},
+        "summarize": {
+            "total": total,
+            "relative": {key: len(description)/total if total else 0 for key, description in descriptions.items()},
+            "absolute": {key: len(description) for key, description in descriptions.items()}
+        },
+        "results": results
+    }
+
+
+class ShardAggregator():
+    '''Aggregation of the Shard Summaries
+
+    Requests `/v1/summarize` of all shards in parallel and merges them. The responses are revalidated with their ETag.
+    An unreachable shard counts as a failed result, so the merged summary is not healthy while a shard is missing.
+
+    Attributes
+    ----------
+    peers : List[str]
+        the base URLs of all shards, e.g. http://opserver-0.opserver-headless:8080
+    timeout : float, default: 5
+        seconds to wait for a shard
+    '''
+
+    def __init__(self, peers: List[str], timeout: float=5) -> None:
+        self.__peers = [peer.rstrip("/") for peer in peers]
+        self.__timeout = timeout
+        self.__session = Session()
+        self.__pool = ThreadPoolExecutor(max_workers=len(self.__peers), thread_name_prefix="shard")
+        # peer -> (etag, summary) of the last response
+        self.__responses = {}
+        self.__lock = threading.Lock()
+
+    def __fetch(self, peer: str) -> dict:
+        with self.__lock:
+            etag, summary = self.__responses.get(peer, (None, None))
+        try:
+            response = self.__session.get(f"{peer}/v1/summarize", headers={"If-None-Match": etag} if etag else {}, timeout=self.__timeout)
+            if response.status_code == 304 and summary is not None:
+                return summary
+            response.raise_for_status()
+            summary = response.json()
+        except Exception as e:
+            message = f"Shard {peer} not reachable: {e}"
+            return {"fails": {"description": [message], "count": 1}, "shard": {"url": peer, "error": str(e)}}
+        with self.__lock:
+            self.__responses[peer] = (response.headers.get("ETag"), summary)
+        return summary
+
+    def summarize(self) -> dict:
+        '''
+        The merged summary of all shards with the state of each shard in `shards`
+        '''
+        summaries = list(self.__pool.map(self.__fetch, self.__peers))
+        merged = merge(summaries)
+        merged["shards"] = [summary.get("shard") or {"url": peer, "lastRun": summary.get("lastRun"), "total": (summary.get("summarize") or {}).get("total", 0)}
+                            for peer, summary in zip(self.__peers, summaries)]
+        return merged
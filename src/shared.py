@@ -0,0 +1,75 @@
+#!/bin/python
+
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+import pickle
+import struct
+import time
+
+
+# sequence number and length of the payload. The sequence is odd while the payload is written
+HEADER = struct.Struct("QQ")
+
+
+class SharedState():
+    '''Latest State shared with another process
+
+    One process publishes an object into a shared memory block, other processes read the latest version of it.
+    Readers never block the writer. A reader retries while a new version is written and only unpickles changed versions.
+    Readers are expected to be started by the publishing process, which removes the block on `close`.
+
+    Attributes
+    ----------
+    name : str, default: None
+        name of the block to attach to. Without a name a new block is created
+    size : int, default: 8 MiB
+        size of a created block
+    '''
+
+    def __init__(self, name: str=None, size: int=8*1024*1024) -> None:
+        self.__owner = name is None
+        self.__memory = SharedMemory(name=name, create=self.__owner, size=size if self.__owner else 0)
+        self.__sequence = 0
+        self.__cached = (0, None)
+
+    @property
+    def name(self) -> str:
+        return self.__memory.name
+
+    def publish(self, state: Any) -> bool:
+        '''
+        Writes a new version. Returns False if it does not fit into the block
+        '''
+        payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        if HEADER.size + len(payload) > self.__memory.size:
+            print(f"Shared state of {len(payload)} bytes exceeds the shared memory of {self.__memory.size} bytes")
+            return False
+        buffer = self.__memory.buf
+        HEADER.pack_into(buffer, 0, self.__sequence + 1, 0)
+        buffer[HEADER.size:HEADER.size + len(payload)] = payload
+        self.__sequence += 2
+        HEADER.pack_into(buffer, 0, self.__sequence, len(payload))
+        return True
+
+    def read(self) -> Any:
+        '''
+        Returns the latest version or None if nothing is published yet
+        '''
+        buffer = self.__memory.buf
+        while True:
+            sequence, length = HEADER.unpack_from(buffer, 0)
+            if sequence == self.__cached[0]:
+                return self.__cached[1]
+            if sequence % 2:
+                time.sleep(0.001)
+                continue
+            payload = bytes(buffer[HEADER.size:HEADER.size + length])
+            if HEADER.unpack_from(buffer, 0)[0] == sequence:
+                break
+        self.__cached = (sequence, pickle.loads(payload))
+        return self.__cached[1]
+
+    def close(self) -> None:
+        self.__memory.close()
+        if self.__owner:
+            self.__memory.unlink()
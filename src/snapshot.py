@@ -0,0 +1,75 @@
+#!/bin/python
+
+from hashlib import blake2b
+import gzip
+import json
+
+
+class Representation():
+    '''Immutable HTTP body
+
+    The body is compressed and hashed once. Both encodings share the weak ETag. Clients may store the body, but
+    revalidate it on every request.
+
+    Attributes
+    ----------
+    body : bytes
+        the uncompressed body
+    contentType : str
+        the Content-Type header
+    headers : dict, default: None
+        extra headers sent with the body
+    '''
+    __slots__ = ("body", "gzip", "etag", "headers")
+
+    def __init__(self, body: bytes, contentType: str, headers: dict=None) -> None:
+        self.body = body
+        self.gzip = gzip.compress(body, compresslevel=6, mtime=0)
+        self.etag = blake2b(body, digest_size=16).hexdigest()
+        self.headers = dict(headers or {})
+        self.headers.update({
+            "Content-Type": contentType,
+            "ETag": f'W/"{self.etag}"',
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding"
+        })
+
+    def response(self, notModified: bool, acceptGzip: bool) -> tuple[bytes, int, dict]:
+        '''
+        Returns body, status code and headers of the response
+
+        Params
+        ------
+        notModified : bool
+            the client already has the ETag
+        acceptGzip : bool
+            the client accepts gzip encoding
+        '''
+        if notModified:
+            return b"", 304, self.headers
+        if acceptGzip:
+            return self.gzip, 200, dict(self.headers, **{"Content-Encoding": "gzip"})
+        return self.body, 200, self.headers
+
+
+class Snapshot():
+    '''API State of a completed QS run
+
+    Serialised once per run, so requests only pick the prepared bytes.
+
+    Attributes
+    ----------
+    summary : dict
+        the JSON summary of `/v1/summarize`
+    status : dict
+        the status headers of `/status`
+    html : str
+        the rendered summary of `/` and `/summarize`
+    '''
+    __slots__ = ("json", "status", "html")
+
+    def __init__(self, summary: dict, status: dict, html: str) -> None:
+        headers = {k: str(v) for k, v in status.items()}
+        self.json = Representation(json.dumps(summary).encode(), "application/json")
+        self.status = Representation(status.get("status_info", "").encode(), "text/html; charset=utf-8", headers)
+        self.html = Representation(html.encode(), "text/html; charset=utf-8", headers)
@@ -0,0 +1,154 @@
+#!/bin/python
+
+from typing import List, Optional
+import sqlite3
+import threading
+import time
+from faillog import Event, Severity
+
+
+HOUR = 3600
+DAY = 24*HOUR
+# rollup buckets per period and how long they are kept. Daily aggregates are kept forever
+PERIODS = {"hour": HOUR, "day": DAY}
+HOURLY_RETENTION = 90*DAY
+COLUMNS = {Severity.OK: "ok", Severity.WARN: "warn", Severity.FAILED: "failed"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    ts REAL NOT NULL,
+    cluster TEXT NOT NULL,
+    "check" TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS results_cluster_check_ts ON results (cluster, "check", ts);
+CREATE INDEX IF NOT EXISTS results_ts ON results (ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    period TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    cluster TEXT NOT NULL,
+    "check" TEXT NOT NULL,
+    ok INTEGER NOT NULL DEFAULT 0,
+    warn INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (cluster, "check", period, bucket)
+) WITHOUT ROWID;
+"""
+
+ROLLUP_HOURS = """
+INSERT INTO rollups (period, bucket, cluster, "check", ok, warn, failed)
+SELECT 'hour', CAST(ts / 3600 AS INTEGER) * 3600 AS hour, cluster, "check",
+       SUM(severity = 'ok'), SUM(severity = 'warn'), SUM(severity = 'failed')
+FROM results WHERE ts < :before
+GROUP BY hour, cluster, "check"
+ON CONFLICT (cluster, "check", period, bucket) DO UPDATE SET
+    ok = ok + excluded.ok, warn = warn + excluded.warn, failed = failed + excluded.failed
+"""
+
+ROLLUP_DAYS = """
+INSERT INTO rollups (period, bucket, cluster, "check", ok, warn, failed)
+SELECT 'day', bucket / 86400 * 86400 AS day, cluster, "check", SUM(ok), SUM(warn), SUM(failed)
+FROM rollups WHERE period = 'hour' AND bucket < :before
+GROUP BY day, cluster, "check"
+ON CONFLICT (cluster, "check", period, bucket) DO UPDATE SET
+    ok = ok + excluded.ok, warn = warn + excluded.warn, failed = failed + excluded.failed
+"""
+
+# raw results and both rollup periods cover disjoint time ranges, so the sum over all of them never counts twice
+TREND = """
+SELECT CAST(ts / :size AS INTEGER) * :size AS bucket, SUM(ok), SUM(warn), SUM(failed) FROM (
+    SELECT ts, severity = 'ok' AS ok, severity = 'warn' AS warn, severity = 'failed' AS failed
+    FROM results WHERE cluster = :cluster AND "check" = :check AND ts >= :since
+    UNION ALL
+    SELECT bucket AS ts, ok, warn, failed
+    FROM rollups WHERE cluster = :cluster AND "check" = :check AND bucket >= :since
+) GROUP BY bucket ORDER BY bucket
+"""
+
+
+class ResultStore():
+    '''SQLite Store for QS results
+
+    Keeps every result of the last `retention` days. Older results are rolled up into hourly aggregates, which are rolled
+    up into daily aggregates after 90 days. The database runs in WAL mode, so the API reads while a run is written.
+
+    Attributes
+    ----------
+    path : str
+        path of the database file
+    retention : int, default: 7
+        days the single results are kept
+    '''
+
+    def __init__(self, path: str, retention: int=7) -> None:
+        self.__path = path
+        self.__retention = retention*DAY
+        self.__local = threading.local()
+        self.__lastRollup = 0
+        with self.__connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def __connection(self) -> sqlite3.Connection:
+        # sqlite connections can not be shared between threads
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.__path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.__local.connection = connection
+        return connection
+
+    def write(self, events: List[Event]) -> None:
+        '''
+        Inserts the results of a run in one transaction and rolls up old data once per hour
+        '''
+        rows = [(e.timestamp, e.cluster, e.check, e.severity.value, e.message) for e in events]
+        with self.__connection() as connection:
+            connection.executemany('INSERT INTO results (ts, cluster, "check", severity, message) VALUES (?, ?, ?, ?, ?)', rows)
+        if time.time() - self.__lastRollup > HOUR:
+            self.rollup()
+
+    def rollup(self, now: Optional[float]=None) -> None:
+        '''
+        Aggregates results older than the retention into hours and hours older than 90 days into days.
+        Only complete buckets are rolled up
+        '''
+        now = time.time() if now is None else now
+        hours = (now - self.__retention) // HOUR * HOUR
+        days = (now - HOURLY_RETENTION) // DAY * DAY
+        with self.__connection() as connection:
+            connection.execute(ROLLUP_HOURS, {"before": hours})
+            connection.execute("DELETE FROM results WHERE ts < ?", (hours,))
+            connection.execute(ROLLUP_DAYS, {"before": days})
+            connection.execute("DELETE FROM rollups WHERE period = 'hour' AND bucket < ?", (days,))
+        self.__lastRollup = now
+
+    def trend(self, cluster: str, check: str, days: int=30, resolution: str="day") -> dict:
+        '''
+        Counts the results of a check per bucket
+
+        Params
+        ------
+        cluster : str
+            the cluster name
+        check : str
+            the name of the check, e.g. `daemonset:canal`
+        days : int, default: 30
+            the time range up to now
+        resolution : str, default: day
+            bucket size, `hour` or `day`. Results older than 90 days only have daily buckets
+        '''
+        if resolution not in PERIODS:
+            raise ValueError(f"resolution must be one of {list(PERIODS)}")
+        since = time.time() - days*DAY
+        rows = self.__connection().execute(TREND, {"size": PERIODS[resolution], "cluster": cluster, "check": check, "since": since}).fetchall()
+        buckets = [{"time": bucket, "ok": ok, "warn": warn, "failed": failed} for bucket, ok, warn, failed in rows]
+        return {
+            "cluster": cluster,
+            "check": check,
+            "since": since,
+            "resolution": resolution,
+            "absolute": {column: sum(b[column] for b in buckets) for column in COLUMNS.values()},
+            "buckets": buckets
+        }